@@ -0,0 +1,281 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from langgraph.config import get_config
+from utils import current_run_id, get_run_id
+
+# Estimated list prices in USD per million tokens, by model name prefix; the longest matching prefix wins
+MODEL_PRICES: Dict[str, Dict[str, float]] = {
+    "claude-opus-4": {"input": 15.0, "output": 75.0, "cache_read": 1.5, "cache_write": 18.75},
+    "claude-sonnet-4": {"input": 3.0, "output": 15.0, "cache_read": 0.3, "cache_write": 3.75},
+    "claude-3-7-sonnet": {"input": 3.0, "output": 15.0, "cache_read": 0.3, "cache_write": 3.75},
+    "claude-3-5-sonnet": {"input": 3.0, "output": 15.0, "cache_read": 0.3, "cache_write": 3.75},
+    "claude-3-5-haiku": {"input": 0.8, "output": 4.0, "cache_read": 0.08, "cache_write": 1.0},
+    "claude-3-opus": {"input": 15.0, "output": 75.0, "cache_read": 1.5, "cache_write": 18.75},
+    "gpt-4o": {"input": 2.5, "output": 10.0, "cache_read": 1.25},
+    "gpt-4o-mini": {"input": 0.15, "output": 0.6, "cache_read": 0.075},
+    "o3-mini": {"input": 1.1, "output": 4.4, "cache_read": 0.55},
+}
+
+# Estimated prices in USD per query of the paid search APIs
+SEARCH_PRICES: Dict[str, float] = {
+    "tavily": 0.008,
+    "exa": 0.005,
+    "perplexity": 0.005,
+    "linkup": 0.005,
+}
+
+
+@dataclass
+class CallRecord:
+    """One model or search call of a run.
+
+    Model calls that escalate through a cascade are one record: `retries` counts the
+    escalations, and the tokens and cost include those of the rejected answers. For
+    searches, `retries` counts rate limited requests that were retried, `queries` the
+    queries sent to the search API and `reused_queries` those served from the search
+    cache or a concurrent identical search, which cost nothing.
+    """
+    kind: str
+    call: str
+    node: str
+    report_id: str
+    section: Optional[str] = None
+    iteration: Optional[int] = None
+    provider: Optional[str] = None
+    model: Optional[str] = None
+    started_at: float = 0.0
+    wall_time: float = 0.0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_creation_tokens: int = 0
+    queries: int = 0
+    reused_queries: int = 0
+    retries: int = 0
+    cost: float = 0.0
+    cached_response: bool = False
+    error: Optional[str] = None
+
+
+@dataclass
+class CallTotals:
+    calls: int = 0
+    wall_time: float = 0.0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_creation_tokens: int = 0
+    queries: int = 0
+    reused_queries: int = 0
+    retries: int = 0
+    cost: float = 0.0
+    cached_responses: int = 0
+    errors: int = 0
+
+    def add(self, record: CallRecord):
+        self.calls += 1
+        self.wall_time += record.wall_time
+        self.input_tokens += record.input_tokens
+        self.output_tokens += record.output_tokens
+        self.cache_read_tokens += record.cache_read_tokens
+        self.cache_creation_tokens += record.cache_creation_tokens
+        self.queries += record.queries
+        self.reused_queries += record.reused_queries
+        self.retries += record.retries
+        self.cost += record.cost
+        self.cached_responses += record.cached_response
+        self.errors += record.error is not None
+
+    @property
+    def cache_hit_rate(self) -> float:
+        """Share of the input tokens served from the provider's prompt cache."""
+        return self.cache_read_tokens / self.input_tokens if self.input_tokens else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), "cache_hit_rate": self.cache_hit_rate}
+
+
+# The section and iteration the calls of the current node are made for, see `tag_calls`
+_call_tags: contextvars.ContextVar[Tuple[Optional[str], Optional[int]]] = contextvars.ContextVar("call_tags", default=(None, None))
+# The record of the call in progress and the prices it is estimated with
+_active_call: contextvars.ContextVar[Optional[Tuple[CallRecord, Dict[str, Any]]]] = contextvars.ContextVar("active_call", default=None)
+
+_records: Dict[str, List[CallRecord]] = {}
+_records_lock = threading.Lock()
+
+
+def tag_calls(section: Optional[str] = None, iteration: Optional[int] = None):
+    """Tags the calls made by everything awaited by the calling node with a section and search iteration."""
+    _call_tags.set((section, iteration))
+
+
+def _graph_context() -> Tuple[str, str]:
+    """The graph node and run of the current context."""
+    try:
+        config = get_config()
+    except RuntimeError:
+        return "", current_run_id.get()
+    return (config.get("metadata") or {}).get("langgraph_node", ""), get_run_id(config)
+
+
+@asynccontextmanager
+async def track_call(kind: str, call: str, prices: Optional[Dict[str, Any]] = None) -> AsyncIterator[CallRecord]:
+    """Records the wall time and usage of one model or search call of the current run.
+
+    Usage is added to the record with `add_model_usage` and `add_search_usage` while
+    the call is in progress. The record is kept, also when the call fails.
+
+    Args:
+        kind: "llm" or "search"
+        call: The name of the model call, see `llm_cache.LLM_CACHE_NODES`, or the search API
+        prices: Prices overriding `MODEL_PRICES` or `SEARCH_PRICES`
+
+    Yields:
+        The record of the call
+    """
+    node, report_id = _graph_context()
+    section, iteration = _call_tags.get()
+    record = CallRecord(kind, call, node, report_id, section, iteration, started_at=time.time())
+    token = _active_call.set((record, prices or {}))
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record.error = type(e).__name__
+        raise
+    finally:
+        record.wall_time = time.perf_counter() - start
+        _active_call.reset(token)
+        with _records_lock:
+            _records.setdefault(report_id, []).append(record)
+
+
+def _model_prices(model: str, prices: Dict[str, Any]) -> Optional[Dict[str, float]]:
+    if model in prices:
+        return prices[model]
+    matches = [prefix for prefix in MODEL_PRICES if model.startswith(prefix)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def add_model_usage(provider: str, model: str, usage_metadata: Optional[Dict[str, Any]], cached: bool = False):
+    """Adds the usage of one model response to the call in progress, if any.
+
+    Args:
+        provider: The provider of the model that answered
+        model: The model that answered
+        usage_metadata: The `usage_metadata` of the response message
+        cached: Whether the response was served from the model response cache
+    """
+    active = _active_call.get()
+    if active is None:
+        return
+    record, prices = active
+    record.provider, record.model = provider, model
+    record.cached_response = record.cached_response or cached
+    if not usage_metadata:
+        return
+    details = usage_metadata.get("input_token_details") or {}
+    input_tokens = usage_metadata.get("input_tokens") or 0
+    output_tokens = usage_metadata.get("output_tokens") or 0
+    cache_read = details.get("cache_read") or 0
+    cache_creation = details.get("cache_creation") or 0
+    record.input_tokens += input_tokens
+    record.output_tokens += output_tokens
+    record.cache_read_tokens += cache_read
+    record.cache_creation_tokens += cache_creation
+
+    price = _model_prices(model, prices)
+    if price is None:
+        return
+    # Input tokens include the tokens read from and written to the prompt cache
+    uncached = max(0, input_tokens - cache_read - cache_creation)
+    record.cost += (
+        uncached * price["input"]
+        + cache_read * price.get("cache_read", price["input"])
+        + cache_creation * price.get("cache_write", price["input"])
+        + output_tokens * price["output"]
+    ) / 1_000_000
+
+
+def add_search_usage(queries: int, reused: int = 0):
+    """Adds queries to the search call in progress, if any.
+
+    Args:
+        queries: Queries sent to the search API, which are charged
+        reused: Queries answered from the search cache or a concurrent search
+    """
+    active = _active_call.get()
+    if active is None:
+        return
+    record, prices = active
+    record.queries += queries
+    record.reused_queries += reused
+    record.cost += queries * prices.get(record.call, SEARCH_PRICES.get(record.call, 0.0))
+
+
+def note_retry():
+    """Counts a retry of the call in progress: an escalation to the next model of a cascade,
+    or a rate limited search or page fetch that is sent again."""
+    active = _active_call.get()
+    if active is not None:
+        active[0].retries += 1
+
+
+def get_call_records(run_id: Optional[str] = None) -> List[CallRecord]:
+    """Returns the records of a run's calls in the order they finished."""
+    with _records_lock:
+        return list(_records.get(run_id or current_run_id.get(), []))
+
+
+def summarize_run(run_id: Optional[str] = None) -> Dict[str, Any]:
+    """Aggregates the call records of a run.
+
+    Returns:
+        The report id, the elapsed time from the first call to the end of the last,
+        the totals of all calls and the totals per graph node, model or search call,
+        and section
+    """
+    run_id = run_id or current_run_id.get()
+    records = get_call_records(run_id)
+    totals = CallTotals()
+    groups = {"by_node": {}, "by_call": {}, "by_section": {}}
+    for record in records:
+        totals.add(record)
+        for group, key in (("by_node", record.node), ("by_call", record.call), ("by_section", record.section)):
+            if key:
+                groups[group].setdefault(key, CallTotals()).add(record)
+    elapsed = max((r.started_at + r.wall_time for r in records), default=0.0) - min((r.started_at for r in records), default=0.0)
+    return {
+        "report_id": run_id,
+        "elapsed": elapsed,
+        **totals.to_dict(),
+        **{group: {key: group_totals.to_dict() for key, group_totals in by.items()} for group, by in groups.items()}
+    }
+
+
+def export_call_records(path: str, run_id: Optional[str] = None) -> int:
+    """Appends the call records of a run to a JSONL file, one record per line.
+
+    Returns:
+        The number of records written
+    """
+    records = get_call_records(run_id)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(asdict(record)) + "\n")
+    return len(records)
+
+
+def release_call_records(run_id: Optional[str] = None):
+    """Forgets the call records of a finished run."""
+    with _records_lock:
+        _records.pop(run_id or current_run_id.get(), None)
@@ -1,7 +1,8 @@
-from dataclasses import dataclass, Field, fields
+from dataclasses import dataclass, field, fields
 from langchain_core.runnables import RunnableConfig
 from enum import Enum
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, List
+from utils import get_config_value
 import os
 
 DEFAULT_REPORT_STRUCTURE = """Use this structure to create a report on the user-provided topic:
@@ -26,18 +27,80 @@ class SearchAPI(Enum):
     DUCKDUCKGO = "duckduckgo"
     GOOGLESEARCH = "googlesearch"
 
+# The configured model role each model call uses when it has no cascade of its own
+NODE_MODEL_ROLES = {
+    "planner_queries": "writer",
+    "planner": "planner",
+    "query_writer": "writer",
+    "section_writer": "writer",
+    "section_grader": "planner",
+    "section_grader_batch": "planner",
+    "final_section_writer": "writer",
+}
+
+# Output tokens left for the answer on top of a thinking budget
+THINKING_ANSWER_TOKENS = 4096
+
+
+@dataclass
+class ModelSpec:
+    provider: str
+    model: str
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+
+
+def thinking_kwargs(provider: str, budget: int) -> Dict[str, Any]:
+    """Model settings enabling extended thinking with the given token budget, where the provider supports it."""
+    if provider != "anthropic" or not budget:
+        return {}
+    return {"max_tokens": budget + THINKING_ANSWER_TOKENS, "thinking": {"type": "enabled", "budget_tokens": budget}}
+
+
 @dataclass(kw_only=True)
 class Configuration:
     """The configurable fields for the chatbot"""
     report_structure: str = DEFAULT_REPORT_STRUCTURE
-    number_of_queries: int = Field(default=2, description="The number of queries to generate per iteration")
-    max_search_depth: int = Field(default=2, description="The maximum number of reflections + search iterations to perform")
-    planner_provider: str = Field(default="anthropic", description="The provider to use for the planner")
-    planner_model: str = Field(default="claude-3-7-sonnet-latest", description="The model to use for the planner")
-    writer_provider: str = Field(default="anthropic", description="The provider to use for the writer")
-    writer_model: str = Field(default="claude-3-7-sonnet-latest", description="The model to use for the writer")
-    search_api: SearchAPI = Field(default=SearchAPI.TAVILY, description="The search API to use")
-    search_api_config: Optional[Dict[str, Any]] = Field(default=None, description="The configuration for the search API")
+    number_of_queries: int = field(default=2, metadata={"description": "The number of queries to generate per iteration"})
+    max_search_depth: int = field(default=2, metadata={"description": "The maximum number of reflections + search iterations to perform"})
+    novelty_threshold: float = field(default=0.2, metadata={"description": "Stop searching for a section once a search iteration adds less than this share of new passages"})
+    max_section_search_queries: Optional[int] = field(default=None, metadata={"description": "The maximum number of search queries per section, None for no limit"})
+    max_run_search_queries: Optional[int] = field(default=None, metadata={"description": "The maximum number of search queries per report run, planning queries included, None for no limit"})
+    batch_grading: bool = field(default=False, metadata={"description": "Grade the sections drafted around the same time in one model call"})
+    grading_batch_window: float = field(default=2.0, metadata={"description": "Seconds to wait for more sections to grade after the first one of a batch"})
+    grading_batch_size: int = field(default=10, metadata={"description": "The maximum number of sections graded in one call"})
+    speculative_search: bool = field(default=False, metadata={"description": "Search for likely follow-up material while a section is being graded"})
+    planner_provider: str = field(default="anthropic", metadata={"description": "The provider to use for the planner"})
+    planner_model: str = field(default="claude-3-7-sonnet-latest", metadata={"description": "The model to use for the planner"})
+    writer_provider: str = field(default="anthropic", metadata={"description": "The provider to use for the writer"})
+    writer_model: str = field(default="claude-3-7-sonnet-latest", metadata={"description": "The model to use for the writer"})
+    llm_timeout: Optional[float] = field(default=300.0, metadata={"description": "Seconds to wait for each model call before cancelling it, None to wait indefinitely"})
+    model_cascades: Optional[Dict[str, List[Dict[str, Any]]]] = field(default=None, metadata={"description": "Per model call (see llm_cache.LLM_CACHE_NODES), the models to try from smallest to largest, as dicts with provider, model and optionally kwargs and thinking_budget; calls without a cascade use the planner or writer model"})
+    cascade_min_confidence: float = field(default=0.7, metadata={"description": "Escalate to the next model of a cascade when a structured answer reports a lower confidence"})
+    thinking_budgets: Optional[Dict[str, int]] = field(default=None, metadata={"description": "Per model call, the extended thinking budget in tokens; a cascade entry's own thinking_budget takes precedence"})
+    stream_tokens: bool = field(default=False, metadata={"description": "Stream section drafts token by token as custom stream events"})
+    search_api: SearchAPI = field(default=SearchAPI.TAVILY, metadata={"description": "The search API to use"})
+    search_api_config: Optional[Dict[str, Any]] = field(default=None, metadata={"description": "The configuration for the search API"})
+    max_tokens_per_source: int = field(default=1000, metadata={"description": "The maximum number of tokens of raw content kept per source"})
+    max_context_tokens: int = field(default=12000, metadata={"description": "The total token budget for the source context of one prompt"})
+    max_passages_per_source: int = field(default=6, metadata={"description": "The maximum number of query-relevant passages kept per source in section context"})
+    near_duplicate_distance: Optional[int] = field(default=3, metadata={"description": "The maximum SimHash distance (0-3 bits) at which sources count as near duplicates, None to disable"})
+    tokenizer: str = field(default="approximate", metadata={"description": "The tokenizer used to measure token budgets: 'approximate' or 'tiktoken[:encoding]'"})
+    seed_sources_per_section: int = field(default=5, metadata={"description": "The number of planning sources passed to each section as seed context"})
+    seed_coverage_threshold: float = field(default=0.8, metadata={"description": "The seed coverage above which a section skips its first search round, above 1 to never skip"})
+    corpus_path: Optional[str] = field(default=None, metadata={"description": "The sqlite file backing the per-run document corpus, None to keep it in memory only"})
+    search_cache: str = field(default="memory", metadata={"description": "The search result cache to use: 'memory', 'sqlite' or 'none'"})
+    search_cache_path: str = field(default=".cache/search_cache.sqlite", metadata={"description": "The path of the sqlite search result cache"})
+    search_cache_max_entries: int = field(default=2048, metadata={"description": "The maximum number of cached search responses before the oldest are evicted"})
+    search_cache_ttl: Optional[Dict[str, int]] = field(default=None, metadata={"description": "Per search API time-to-live in seconds, overriding the defaults"})
+    llm_cache: str = field(default="none", metadata={"description": "The model response cache to use: 'sqlite' or 'none'"})
+    llm_cache_path: str = field(default=".cache/llm_cache.sqlite", metadata={"description": "The path of the sqlite model response cache"})
+    llm_cache_nodes: Optional[List[str]] = field(default=None, metadata={"description": "The model calls that use the cache, see llm_cache.LLM_CACHE_NODES; None for query generation and grading"})
+    llm_cache_ttl: int = field(default=7 * 24 * 60 * 60, metadata={"description": "Seconds a cached model response stays valid"})
+    llm_cache_max_entries: int = field(default=10000, metadata={"description": "The maximum number of cached model responses before the least recently used are evicted"})
+    llm_cache_bypass: bool = field(default=False, metadata={"description": "Ignore cached model responses, still caching the fresh ones"})
+    model_prices: Optional[Dict[str, Dict[str, float]]] = field(default=None, metadata={"description": "Per model, USD per million input, output, cache_read and cache_write tokens, overriding accounting.MODEL_PRICES"})
+    search_prices: Optional[Dict[str, float]] = field(default=None, metadata={"description": "Per search API, USD per query, overriding accounting.SEARCH_PRICES"})
+    accounting_path: Optional[str] = field(default=None, metadata={"description": "A JSONL file the records of every model and search call are appended to when a run completes, None to only summarize them"})
 
     @classmethod
     def from_runnable_config(cls, config: Optional[RunnableConfig]) -> "Configuration":
@@ -49,4 +112,26 @@ class Configuration:
             if f.init
         }
 
-        return cls(**{k:v for k,v in values.items() if v is not None})
\ No newline at end of file
+        return cls(**{k:v for k,v in values.items() if v is not None})
+
+    def model_cascade(self, node: str) -> List[ModelSpec]:
+        """The models to try, in order, for one model call of the graph.
+
+        Args:
+            node: The name of the model call, see `llm_cache.LLM_CACHE_NODES`
+
+        Returns:
+            The model specs, with the node's thinking budget applied
+        """
+        entries = (self.model_cascades or {}).get(node)
+        if not entries:
+            role = NODE_MODEL_ROLES.get(node, "writer")
+            entries = [{"provider": getattr(self, f"{role}_provider"), "model": getattr(self, f"{role}_model")}]
+
+        budget = (self.thinking_budgets or {}).get(node)
+        cascade = []
+        for entry in entries:
+            provider = get_config_value(entry["provider"])
+            kwargs = {**thinking_kwargs(provider, entry.get("thinking_budget", budget)), **(entry.get("kwargs") or {})}
+            cascade.append(ModelSpec(provider, get_config_value(entry["model"]), kwargs))
+        return cascade
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from langchain_core.runnables import RunnableConfig
+from configuration import Configuration
+from state import Feedback, Section
+from utils import current_run_id
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class GradeRequest:
+    topic: str
+    section: Section
+    number_of_follow_up_queries: int
+    # The settings and node config of the section asking, used for the batch it joins
+    configurable: Configuration
+    config: RunnableConfig
+
+
+# Grades a batch of requests, returning the feedback per section name
+GradeBatchFn = Callable[[List[GradeRequest]], Awaitable[Dict[str, Feedback]]]
+
+
+class GradeBatcher:
+    """Collects the grading requests of concurrently running sections into one model call.
+
+    A batch is sent once `max_batch` requests are waiting or `window` seconds after
+    the first one arrived. Only requests with the same settings share a call, which
+    runs with the node config of one of its own requests. Requests the batch call does
+    not answer, batches of a single section and batches whose call was cancelled
+    resolve to None so the caller grades them on its own.
+    """
+
+    def __init__(self, grade_batch: GradeBatchFn, window: float = 2.0, max_batch: int = 10):
+        self.grade_batch = grade_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[Tuple[GradeRequest, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.stats = {"requests": 0, "batches": 0, "batched": 0, "unbatched": 0}
+
+    async def grade(self, request: GradeRequest) -> Optional[Feedback]:
+        """Waits for the request's batch and returns its feedback, None to grade it individually."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((request, future))
+        self.stats["requests"] += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        groups: List[List[Tuple[GradeRequest, asyncio.Future]]] = []
+        for request, future in pending:
+            if future.done():
+                continue
+            group = next((group for group in groups if group[0][0].configurable == request.configurable), None)
+            if group is None:
+                groups.append([(request, future)])
+            else:
+                group.append((request, future))
+        for batch in groups:
+            if len(batch) == 1:
+                self.stats["unbatched"] += 1
+                batch[0][1].set_result(None)
+                continue
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[GradeRequest, asyncio.Future]]):
+        self.stats["batches"] += 1
+        try:
+            feedbacks = await self.grade_batch([request for request, _ in batch])
+        except asyncio.CancelledError:
+            for _, future in batch:
+                if not future.done():
+                    self.stats["unbatched"] += 1
+                    future.set_result(None)
+            raise
+        except Exception as e:
+            logger.warning(f"Batched grading of {len(batch)} sections failed, grading them individually: {e}")
+            feedbacks = {}
+        for request, future in batch:
+            if future.done():
+                continue
+            feedback = feedbacks.get(request.section.name)
+            if feedback is None:
+                self.stats["unbatched"] += 1
+            else:
+                self.stats["batched"] += 1
+            future.set_result(feedback)
+
+
+_batchers: Dict[str, GradeBatcher] = {}
+_batchers_lock = threading.Lock()
+
+
+def get_grade_batcher(make_batcher: Callable[[], GradeBatcher], run_id: Optional[str] = None) -> GradeBatcher:
+    """Returns the grade batcher of the given run, created with `make_batcher` on first use."""
+    run_id = run_id or current_run_id.get()
+    with _batchers_lock:
+        batcher = _batchers.get(run_id)
+        if batcher is None:
+            batcher = _batchers[run_id] = make_batcher()
+        return batcher
+
+
+def release_grade_batcher(run_id: Optional[str] = None):
+    """Forgets the grade batcher of a finished run."""
+    with _batchers_lock:
+        _batchers.pop(run_id or current_run_id.get(), None)
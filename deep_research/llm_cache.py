@@ -0,0 +1,100 @@
+import json
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+from langchain_core.messages import BaseMessage
+from search.cache import SQLiteSearchCache
+
+logger = logging.getLogger(__name__)
+
+# Model calls a run can cache, named after the step that makes them
+LLM_CACHE_NODES = (
+    "planner_queries",
+    "planner",
+    "query_writer",
+    "section_writer",
+    "section_grader",
+    "section_grader_batch",
+    "final_section_writer",
+)
+
+# Calls cached by default: prompts whose answers are used as structured decisions, not prose
+DEFAULT_LLM_CACHE_NODES = ("planner_queries", "query_writer", "section_grader", "section_grader_batch")
+
+
+def make_llm_cache_key(spec: Dict[str, Any], messages: List[BaseMessage]) -> str:
+    """Builds the cache key of one model call.
+
+    Args:
+        spec: The model description from `models.model_spec`: provider, model, params and schema
+        messages: The prompt messages
+
+    Returns:
+        A sha256 hex digest over provider, model, params, messages and output schema
+    """
+    schema = spec.get("schema")
+    payload = json.dumps(
+        {
+            "provider": spec["provider"],
+            "model": spec["model"],
+            "params": spec["params"],
+            "schema": schema.model_json_schema() if schema is not None else None,
+            "messages": [[message.type, message.content] for message in messages],
+        },
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache(SQLiteSearchCache):
+    """On-disk cache of model responses, shared by every run using the same file.
+
+    Stored like search responses, with the model call in place of the search API.
+    Entries expire after `ttl` seconds; entries beyond `max_entries` are evicted least
+    recently used first. Use the async accessors from the event loop.
+    """
+
+    table = "llm_cache"
+    label_column = "node"
+
+    def __init__(self, path: str, max_entries: int = 10000, ttl: int = 7 * 24 * 60 * 60):
+        super().__init__(path, max_entries)
+        self.ttl = ttl
+
+    def ttl_for(self, node: str) -> int:
+        return self.ttl
+
+
+_caches: Dict[tuple, LLMCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_llm_cache(configurable, node: str) -> Optional[LLMCache]:
+    """Returns the process-wide model response cache for a node, or None if the node does not use it.
+
+    Args:
+        configurable: Configuration with the llm_cache* fields
+        node: One of LLM_CACHE_NODES
+
+    Returns:
+        The shared LLMCache instance for these settings
+    """
+    kind = (configurable.llm_cache or "none").lower()
+    if kind == "none":
+        return None
+    if kind != "sqlite":
+        raise ValueError(f"Unsupported LLM cache: {kind}")
+    nodes = configurable.llm_cache_nodes
+    if isinstance(nodes, str):
+        nodes = [name.strip() for name in nodes.split(",")]
+    if node not in (nodes if nodes is not None else DEFAULT_LLM_CACHE_NODES):
+        return None
+
+    cache_id = (configurable.llm_cache_path, int(configurable.llm_cache_max_entries), int(configurable.llm_cache_ttl))
+    with _caches_lock:
+        cache = _caches.get(cache_id)
+        if cache is None:
+            cache = _caches[cache_id] = LLMCache(*cache_id)
+        return cache
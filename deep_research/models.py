@@ -0,0 +1,338 @@
+import asyncio
+import logging
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, Type, Union
+from pydantic import BaseModel
+from langchain.chat_models import init_chat_model
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.runnables import Runnable, RunnableConfig
+from llm_cache import LLMCache, make_llm_cache_key, get_llm_cache
+from accounting import add_model_usage, note_retry, track_call
+from configuration import Configuration, ModelSpec
+
+logger = logging.getLogger(__name__)
+
+
+class _Registry:
+    """The clients of one event loop and what each was built from, by object id, for cache keys."""
+
+    def __init__(self):
+        self.models: Dict[Hashable, BaseChatModel] = {}
+        self.structured_models: Dict[Hashable, Runnable] = {}
+        self.specs: Dict[int, Dict[str, Any]] = {}
+
+
+# Async clients keep connection pools bound to the event loop they first ran on, so keep one registry per loop
+_registries: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _Registry]" = weakref.WeakKeyDictionary()
+# Clients created outside a running event loop
+_loopless_registry = _Registry()
+_lock = threading.Lock()
+_stats = {"clients_created": 0, "client_hits": 0, "structured_created": 0, "structured_hits": 0, "escalations": 0}
+
+
+def _freeze(value: Any) -> Hashable:
+    """Turns model kwargs into a hashable key, independent of dict ordering."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, set):
+        return tuple(sorted(_freeze(item) for item in value))
+    return value
+
+
+def _registry() -> _Registry:
+    """The registry of the running event loop. Call with `_lock` held."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _loopless_registry
+    registry = _registries.get(loop)
+    if registry is None:
+        registry = _registries[loop] = _Registry()
+    return registry
+
+
+def _all_registries() -> List[_Registry]:
+    return [_loopless_registry, *_registries.values()]
+
+
+def _model_key(provider: str, model: str, kwargs: Dict[str, Any]) -> Hashable:
+    return (provider, model, _freeze(kwargs))
+
+
+def get_chat_model(provider: str, model: str, **kwargs) -> BaseChatModel:
+    """Returns the shared chat model client for a provider, model and settings.
+
+    Clients are created once per event loop with `init_chat_model` and then reused, so
+    their HTTP connection pools are shared by every node and section of every run on
+    the loop.
+
+    Args:
+        provider: The model provider, e.g. "anthropic"
+        model: The model name
+        **kwargs: Further settings passed to `init_chat_model`, part of the registry key
+
+    Returns:
+        The chat model client
+    """
+    key = _model_key(provider, model, kwargs)
+    with _lock:
+        registry = _registry()
+        client = registry.models.get(key)
+        if client is not None:
+            _stats["client_hits"] += 1
+            return client
+        client = registry.models[key] = init_chat_model(model=model, model_provider=provider, **kwargs)
+        registry.specs[id(client)] = {"provider": provider, "model": model, "params": kwargs, "schema": None}
+        _stats["clients_created"] += 1
+    logger.debug(f"Created chat model client {provider}:{model}")
+    return client
+
+
+def get_structured_model(provider: str, model: str, schema: Type[BaseModel], **kwargs) -> Runnable:
+    """Returns the shared structured output variant of a chat model client.
+
+    Args:
+        provider: The model provider, e.g. "anthropic"
+        model: The model name
+        schema: The pydantic model the output is parsed into
+        **kwargs: Further settings passed to `init_chat_model`, part of the registry key
+
+    Returns:
+        The client wrapped with `with_structured_output(schema, include_raw=True)`; pass it to
+        `ainvoke_model` to get the parsed output
+    """
+    key = (_model_key(provider, model, kwargs), schema)
+    with _lock:
+        structured = _registry().structured_models.get(key)
+        if structured is not None:
+            _stats["structured_hits"] += 1
+            return structured
+    # The raw message is kept for its token usage; `_call_model` unwraps the parsed output
+    built = get_chat_model(provider, model, **kwargs).with_structured_output(schema, include_raw=True)
+    with _lock:
+        registry = _registry()
+        # Keep the first wrapper if another thread built one meanwhile
+        structured = registry.structured_models.setdefault(key, built)
+        if structured is built:
+            registry.specs[id(structured)] = {"provider": provider, "model": model, "params": kwargs, "schema": schema}
+            _stats["structured_created"] += 1
+        else:
+            _stats["structured_hits"] += 1
+    return structured
+
+
+def model_spec(model: Runnable) -> Optional[Dict[str, Any]]:
+    """Returns the provider, model, params and output schema a registry client was built from."""
+    with _lock:
+        return _registry().specs.get(id(model))
+
+
+def _encode_response(response: Any) -> dict:
+    if isinstance(response, BaseMessage):
+        return {"kind": "message", "value": message_to_dict(response)}
+    return {"kind": "structured", "value": response.model_dump(mode="json")}
+
+
+def _decode_response(entry: dict, spec: Dict[str, Any]) -> Any:
+    if entry["kind"] == "message":
+        return messages_from_dict([entry["value"]])[0]
+    return spec["schema"].model_validate(entry["value"])
+
+
+async def _call_model(model: Runnable, messages: List[BaseMessage], call: Callable[[], Awaitable[Any]],
+                      timeout: Optional[float], cache: Optional[LLMCache], node: str, bypass_cache: bool) -> Tuple[Any, bool]:
+    key = None
+    spec = model_spec(model) or {}
+    if cache is not None and spec:
+        key = make_llm_cache_key(spec, messages)
+        if not bypass_cache:
+            entry = (await cache.aget_many([key]))[0]
+            if entry is not None:
+                add_model_usage(spec["provider"], spec["model"], None, cached=True)
+                return _decode_response(entry, spec), True
+
+    try:
+        response = await asyncio.wait_for(call(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Model call timed out after {timeout}s")
+        raise
+
+    if isinstance(response, dict) and "parsed" in response:
+        add_model_usage(spec.get("provider"), spec.get("model", ""), response["raw"].usage_metadata)
+        if response.get("parsing_error") is not None:
+            raise response["parsing_error"]
+        response = response["parsed"]
+    elif isinstance(response, BaseMessage):
+        add_model_usage(spec.get("provider"), spec.get("model", ""), response.usage_metadata)
+
+    if key is not None:
+        await cache.aset_many([(key, _encode_response(response))], node)
+    return response, False
+
+
+async def ainvoke_model(model: Runnable, messages: List[BaseMessage], timeout: Optional[float] = None,
+                        config: Optional[RunnableConfig] = None, cache: Optional[LLMCache] = None,
+                        node: str = "", bypass_cache: bool = False) -> Any:
+    """Calls a model without blocking the event loop, giving up after `timeout` seconds.
+
+    On timeout, or when the calling node is cancelled, the pending request is
+    cancelled with it instead of being left to finish in the background.
+    With a cache, a call identical to an earlier one (same provider, model, params,
+    messages and output schema) is answered from the cache.
+
+    Args:
+        model: A chat model or structured output variant from the registry
+        messages: The prompt messages
+        timeout: Seconds to wait for the response, None to wait indefinitely
+        config: The node's config, so callbacks and tracing follow the call
+        cache: Optional model response cache, see `llm_cache.get_llm_cache`
+        node: The name of the call, stored with cache entries
+        bypass_cache: Skip the cache lookup, still caching the fresh response
+
+    Returns:
+        The model response
+
+    Raises:
+        asyncio.TimeoutError: If the model did not respond in time
+    """
+    response, _ = await _call_model(
+        model, messages, lambda: model.ainvoke(messages, config), timeout, cache, node, bypass_cache
+    )
+    return response
+
+
+def message_text(message: BaseMessage) -> str:
+    """The text of a message or chunk, leaving out thinking and other non-text content blocks."""
+    if isinstance(message.content, str):
+        return message.content
+    return "".join(block.get("text", "") for block in message.content if isinstance(block, dict) and block.get("type") == "text")
+
+
+async def astream_model(model: BaseChatModel, messages: List[BaseMessage], on_token: Callable[[str], None],
+                        timeout: Optional[float] = None, config: Optional[RunnableConfig] = None,
+                        cache: Optional[LLMCache] = None, node: str = "", bypass_cache: bool = False) -> BaseMessage:
+    """Like `ainvoke_model`, but hands each text chunk to `on_token` as the model generates it.
+
+    A response served from the cache is handed over as a single chunk. The timeout
+    applies to the whole response.
+
+    Returns:
+        The complete response message
+    """
+    async def collect():
+        message = None
+        async for chunk in model.astream(messages, config):
+            message = chunk if message is None else message + chunk
+            text = message_text(chunk)
+            if text:
+                on_token(text)
+        return message
+
+    response, cached = await _call_model(model, messages, collect, timeout, cache, node, bypass_cache)
+    if cached:
+        on_token(message_text(response))
+    return response
+
+
+async def ainvoke_cascade(cascade: List[ModelSpec], messages: Callable[[str], List[BaseMessage]],
+                          schema: Optional[Type[BaseModel]] = None, timeout: Optional[float] = None,
+                          config: Optional[RunnableConfig] = None, cache: Optional[LLMCache] = None, node: str = "",
+                          bypass_cache: bool = False, min_confidence: Optional[float] = None) -> Any:
+    """Calls the models of a cascade in order until one gives an acceptable answer.
+
+    A model's answer is rejected, and the next model tried, when the call fails (for
+    example because the structured output does not parse) or when the answer reports
+    a `confidence` below `min_confidence`. The last model's answer is always used.
+
+    Args:
+        cascade: The models to try, see `Configuration.model_cascade`
+        messages: Builds the prompt for a provider, see `prompt_cache.build_messages`
+        schema: The structured output schema, None for a plain message
+        timeout, config, cache, node, bypass_cache: As for `ainvoke_model`
+        min_confidence: The confidence below which an answer is escalated
+
+    Returns:
+        The accepted response
+    """
+    for i, spec in enumerate(cascade):
+        last = i == len(cascade) - 1
+        if schema is None:
+            model = get_chat_model(spec.provider, spec.model, **spec.kwargs)
+        else:
+            model = get_structured_model(spec.provider, spec.model, schema, **spec.kwargs)
+        try:
+            response = await ainvoke_model(model, messages(spec.provider), timeout, config, cache, node, bypass_cache)
+        except Exception as e:
+            if last:
+                raise
+            logger.info(f"{node}: {spec.provider}:{spec.model} failed, escalating: {e}")
+            _count("escalations")
+            note_retry()
+            continue
+        confidence = getattr(response, "confidence", None)
+        if not last and min_confidence is not None and confidence is not None and confidence < min_confidence:
+            logger.info(f"{node}: {spec.provider}:{spec.model} answered with confidence {confidence:.2f}, escalating")
+            _count("escalations")
+            note_retry()
+            continue
+        return response
+
+
+async def ainvoke_node(node: str, messages: Union[List[BaseMessage], Callable[[str], List[BaseMessage]]],
+                       configurable: Configuration, config: Optional[RunnableConfig] = None,
+                       schema: Optional[Type[BaseModel]] = None) -> Any:
+    """Calls the model cascade configured for one model call of the graph, recording its usage.
+
+    Args:
+        node: The name of the model call, see `llm_cache.LLM_CACHE_NODES`
+        messages: The prompt, or a function building it for a provider
+        configurable: The run configuration, supplying the cascade, timeout and cache settings
+        config: The node's config
+        schema: The structured output schema, None for a plain message
+
+    Returns:
+        The accepted response
+    """
+    async with track_call("llm", node, configurable.model_prices):
+        return await ainvoke_cascade(
+            configurable.model_cascade(node),
+            messages if callable(messages) else (lambda provider: messages),
+            schema,
+            configurable.llm_timeout,
+            config,
+            get_llm_cache(configurable, node),
+            node,
+            configurable.llm_cache_bypass,
+            configurable.cascade_min_confidence
+        )
+
+
+def _count(stat: str):
+    with _lock:
+        _stats[stat] += 1
+
+
+def get_model_stats() -> Dict[str, int]:
+    """Returns counters of the model registry: clients and structured variants created and reused, and cascade escalations."""
+    with _lock:
+        registries = _all_registries()
+        return {
+            **_stats,
+            "clients": sum(len(registry.models) for registry in registries),
+            "structured_models": sum(len(registry.structured_models) for registry in registries)
+        }
+
+
+def clear_model_registry(provider: Optional[str] = None):
+    """Drops the cached clients, of one provider or of all, e.g. after rotating API keys."""
+    with _lock:
+        for registry in _all_registries():
+            for clients in (registry.models, registry.structured_models):
+                for key in list(clients):
+                    model_key = key if clients is registry.models else key[0]
+                    if provider is None or model_key[0] == provider:
+                        registry.specs.pop(id(clients.pop(key)), None)
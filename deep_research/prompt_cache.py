@@ -0,0 +1,57 @@
+from typing import List, Tuple
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+# Providers that take explicit cache breakpoints on content blocks. OpenAI caches long
+# prompt prefixes on its own, so there only the stable-first block order matters.
+CACHE_CONTROL_PROVIDERS = {"anthropic"}
+
+# Anthropic accepts at most four breakpoints per request
+MAX_CACHE_BREAKPOINTS = 4
+
+# Anthropic does not cache prefixes shorter than this (2048 for Haiku models), so a
+# breakpoint on a shorter prefix would only use up one of the four
+MIN_CACHE_PREFIX_TOKENS = 1024
+# Rough characters per token, good enough to decide whether a prefix is long enough
+CHARS_PER_TOKEN = 4
+
+# A block of prompt text and whether the prompt prefix up to and including it should be cached
+PromptBlock = Tuple[str, bool]
+
+
+def _content(blocks: List[PromptBlock], state: dict):
+    content = []
+    for text, cache in blocks:
+        block = {"type": "text", "text": text}
+        state["prefix_chars"] += len(text)
+        long_enough = state["prefix_chars"] >= MIN_CACHE_PREFIX_TOKENS * CHARS_PER_TOKEN
+        if cache and long_enough and state["breakpoints"] > 0:
+            block["cache_control"] = {"type": "ephemeral"}
+            state["breakpoints"] -= 1
+        content.append(block)
+    return content
+
+
+def build_messages(provider: str, system: List[PromptBlock], human: List[PromptBlock]) -> List[BaseMessage]:
+    """Assembles a system and a human message from blocks ordered from most to least stable.
+
+    For providers with explicit prompt caching, every block flagged for caching ends
+    a cached prefix, provided the prefix is long enough to be cached at all; other
+    providers get the blocks joined into plain strings. Only flag blocks whose prefix
+    is sent again by later calls: writing a prefix to the cache costs more than
+    sending it uncached.
+
+    Args:
+        provider: The model provider the messages are sent to
+        system: The blocks of the system message
+        human: The blocks of the human message
+
+    Returns:
+        The system and human messages
+    """
+    if provider not in CACHE_CONTROL_PROVIDERS:
+        return [
+            SystemMessage(content="\n".join(text for text, _ in system)),
+            HumanMessage(content="\n".join(text for text, _ in human))
+        ]
+    state = {"prefix_chars": 0, "breakpoints": MAX_CACHE_BREAKPOINTS}
+    return [SystemMessage(content=_content(system, state)), HumanMessage(content=_content(human, state))]
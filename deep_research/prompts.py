@@ -106,7 +106,11 @@ Call the sections tool
 """
 ###############################################################################################################################################################################
 
-section_writer_inputs = """
+# The writer prompt is assembled from stable to volatile parts: section_writer_instructions (the
+# same for every section), then section_writer_context (one per section and search iteration), then
+# section_writer_draft. The instructions alone are below prompt_cache.MIN_CACHE_PREFIX_TOKENS, so the prefix
+# shared across calls is too short for providers to cache.
+section_writer_context = """
 <Report topic>
 {topic}
 </Report topic>
@@ -119,15 +123,17 @@ section_writer_inputs = """
 {section_topic}
 </Section Topic>
 
-<Existing section content (if populated)>
-{section_content}
-</Existing section content>
-
 <Source material>
 {context}
 </Source material>
 """
 
+section_writer_draft = """
+<Existing section content (if populated)>
+{section_content}
+</Existing section content>
+"""
+
 ###############################################################################################################################################################################
 
 section_writer_instructions = """Write one section of a research report.
@@ -167,24 +173,12 @@ section_writer_instructions = """Write one section of a research report.
 
 ###############################################################################################################################################################################
 
-section_grader_instructions = """Review a report section relative to the specified topic:
-
-<Report topic>
-{topic}
-</Report topic>
-
-<section topic>
-{section_topic}
-</section topic>
-
-<section content>
-{section}
-</section content>
+section_grader_instructions = """Review a report section relative to the specified topic.
 
 <task>
 Evaluate whether the section content adequately addresses the section topic.
 
-If the section content does not adequately address the section topic, generate {number_of_follow_up_queries} follow-up search queries to gather missing information.
+If the section content does not adequately address the section topic, generate follow-up search queries to gather missing information.
 </task>
 
 <format>
@@ -196,27 +190,61 @@ grade: Literal["pass","fail"] = Field(
 follow_up_queries: List[SearchQuery] = Field(
     description="List of follow-up search queries.",
 )
+confidence: float = Field(
+    description="How confident you are in the grade, between 0 and 1."
+)
 </format>
 """
-###############################################################################################################################################################################
-
-final_section_writer_instructions = """You are an expert technical writer crafting a section that synthesizes information from the rest of the report.
 
+section_grader_inputs = """
 <Report topic>
 {topic}
 </Report topic>
 
-<Section Name>
-{section_name}
-</Section Name>
+<section topic>
+{section_topic}
+</section topic>
 
-<Section Topic>
+<section content>
+{section}
+</section content>
+
+Grade the section and consider follow-up questions for missing information.
+If the grade is 'pass', return an empty list of follow-up queries.
+If the grade is 'fail', provide {number_of_follow_up_queries} specific search queries to gather the missing information.
+"""
+###############################################################################################################################################################################
+
+batch_grader_instructions = """Review several sections of a report, each relative to its own section topic.
+
+<task>
+Evaluate each section independently: does its content adequately address its section topic?
+
+For every section that does not, generate follow-up search queries to gather the missing information,
+at most the number requested for that section. Sections that pass get an empty list of follow-up queries.
+</task>
+
+<format>
+Call the SectionGrades tool with exactly one grade per section. Copy each section name exactly as given.
+Give each grade a confidence between 0 and 1.
+</format>
+"""
+
+batch_grader_section = """
+<section name="{section_name}" follow_up_queries="{number_of_follow_up_queries}">
+<section topic>
 {section_topic}
-</Section Topic>
+</section topic>
 
-<Available Report Content>
-{context}
-</Available Report Content>
+<section content>
+{section}
+</section content>
+</section>
+"""
+
+###############################################################################################################################################################################
+
+final_section_writer_instructions = """You are an expert technical writer crafting a section that synthesizes information from the rest of the report.
 
 <Task>
 1. Section-Specific Approach:
@@ -258,4 +286,27 @@ For Conclusion/Summary:
 - For conclusion: 100-150 word limit, ## for section title, only ONE structural element at most, no sources section
 - Markdown format
 - Do not include word count or any preamble in your response
-</Quality Checks>"""
\ No newline at end of file
+</Quality Checks>"""
+
+# Shared by every final section of a report, so it goes before the section specific part
+final_section_writer_context = """
+<Report topic>
+{topic}
+</Report topic>
+
+<Available Report Content>
+{context}
+</Available Report Content>
+"""
+
+final_section_writer_inputs = """
+<Section Name>
+{section_name}
+</Section Name>
+
+<Section Topic>
+{section_topic}
+</Section Topic>
+
+Generate a report section based on the provided sources.
+"""
@@ -1,30 +1,77 @@
-from utils import get_config_value, get_search_params
+from utils import get_config_value, get_search_params, bind_run, get_run_id
 from state import (
     ReportState, 
     Queries, 
     Sections, 
     SectionState, 
     Feedback, 
-    Section
+    Section,
+    SectionGrades,
+    SearchQuery
 )
 from configuration import Configuration
 from langgraph.types import Command, interrupt
 from langgraph.constants import Send
 from langchain_core.runnables import RunnableConfig
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain.chat_models import init_chat_model
+from models import get_chat_model, ainvoke_node, astream_model, message_text
+from llm_cache import get_llm_cache
+from prompt_cache import PromptBlock, build_messages
+from accounting import (
+    track_call,
+    tag_calls,
+    summarize_run,
+    export_call_records,
+    release_call_records
+)
+from grading import GradeBatcher, GradeRequest, get_grade_batcher, release_grade_batcher
+from streaming import (
+    emit_progress,
+    token_emitter,
+    section_completed,
+    start_report_assembler,
+    release_report_assembler
+)
 from prompts import (
     report_planner_query_writer_instructions, 
     report_planner_instructions, 
     section_writer_instructions, 
-    section_writer_inputs, 
+    section_writer_context,
+    section_writer_draft,
     section_grader_instructions,
-    final_section_writer_instructions
+    section_grader_inputs,
+    batch_grader_instructions,
+    batch_grader_section,
+    final_section_writer_instructions,
+    final_section_writer_context,
+    final_section_writer_inputs
+)
+from search.search_utils import execute_search, deduplicate_and_format_sources, format_sources
+from search.corpus import Corpus, get_run_corpus, release_run_corpus
+from search.cache import get_search_cache
+from search.context import get_tokenizer
+from search.http_session import hold_http_session, release_http_session
+from search.singleflight import get_search_flight
+from search.dedup import get_dedup_stats, release_dedup_stats
+from search.budget import get_run_search_budget, release_run_search_budget
+from research_steps import (
+    select_seed_sources,
+    section_coverage,
+    speculative_queries,
+    query_overlap,
+    search_section
 )
-from search.search_utils import select_and_execute_search
-from typing import Literal
+from typing import Dict, List, Literal
+import math
+import asyncio
+import logging
 from langgraph.graph import END
 
+logger = logging.getLogger(__name__)
+
+# Term overlap above which a prefetched query stands in for a grader follow-up query
+SPECULATION_MATCH = 0.5
+
 
 async def generate_report_plan(state: ReportState, config: RunnableConfig):
     """Generate the inital report plan with sessions.
@@ -33,31 +80,32 @@ async def generate_report_plan(state: ReportState, config: RunnableConfig):
     2. Generates search queries to gather context for planning
     3. Performs web searches using those queries
     4. Uses an LLM to generate a structured report plan
+    5. Keeps the search results in the run corpus as seed sources for the sections
     
     Args:
         state: Current state with report details
         config: Configuration for report generation
         
     Returns:
-        Updated state with generated sections
+        Updated state with generated sections and the corpus ids of the planning sources
     """
+    run_id = bind_run(config)
+    hold_http_session(run_id)
     topic = state["topic"]
     feedback = state.get("feedback_on_report_plan", None)
-    configuration = config.from_runnable_config(config)
+    configuration = Configuration.from_runnable_config(config)
     report_structure = configuration.report_structure
     number_of_queries = configuration.number_of_queries
-    search_api = get_config_value(configuration.search_api, "google")
-    search_api_config = get_config_value(configuration.search_api_config, {})
+    search_api = get_config_value(configuration.search_api)
+    search_api_config = configuration.search_api_config or {}
     params_to_pass = get_search_params(search_api, search_api_config)
+    search_cache = get_search_cache(configuration)
+    # Create the corpus with its backing file before the first search's page fetches look it up
+    corpus = await asyncio.to_thread(get_run_corpus, run_id, configuration.corpus_path)
 
     if isinstance(report_structure, dict):
         report_structure = str(report_structure)
     
-    writer_provider = get_config_value(configuration.writer_provider)
-    writer_model_name = get_config_value(configuration.writer_model)
-    writer_model = init_chat_model(model=writer_model_name, model_provider=writer_provider)
-    structured_llm = writer_model.with_structured_output(Queries)
-    
     # Format the system instructions for the query writer
     system_instructions_query = report_planner_query_writer_instructions.format(
         topic=topic,
@@ -66,15 +114,29 @@ async def generate_report_plan(state: ReportState, config: RunnableConfig):
     )
 
     # Generate the queries
-    structured_llm = writer_model.with_structured_output(Queries)
-    results = structured_llm.invoke([
+    results = await ainvoke_node("planner_queries", [
         SystemMessage(content=system_instructions_query), 
         HumanMessage(content="Generate search queries that will help with planning the sections of the report.")
-    ])
+    ], configuration, config, schema=Queries)
 
     query_list = [q.search_query for q in results.queries]
-
-    source_str = await select_and_execute_search(search_api, query_list, params_to_pass)
+    # Planning queries count against the run's query budget like those of the sections
+    granted = get_run_search_budget(run_id, configuration.max_run_search_queries).take(len(query_list))
+    query_list = query_list[:granted]
+
+    async with track_call("search", search_api, configuration.search_prices):
+        search_results = await execute_search(search_api, query_list, params_to_pass, search_cache)
+    # Keep the planning results so sections can start from them
+    planning_source_refs = await asyncio.to_thread(corpus.add_responses, search_results)
+    # Ranking and packing are CPU bound, keep them off the event loop
+    source_str = await asyncio.to_thread(
+        deduplicate_and_format_sources,
+        search_results,
+        configuration.max_tokens_per_source,
+        max_total_tokens=configuration.max_context_tokens,
+        tokenizer=get_tokenizer(configuration.tokenizer),
+        near_duplicate_distance=configuration.near_duplicate_distance
+    )
 
     system_instructions_sections = report_planner_instructions.format(
         topic=topic, 
@@ -83,33 +145,17 @@ async def generate_report_plan(state: ReportState, config: RunnableConfig):
         feedback=feedback
     )
 
-    planner_provider = get_config_value(configuration.planner_provider)
-    planner_model = get_config_value(configuration.planner_model)
-
     planner_message = """Generate the section of the report. Your response must include a 'sections' field containing a list of sections. Each section
     must have: name, description, plan, research, and content fields."""
 
-    if planner_model == "claude-3.7-sonnel-latest":
-        #allocate a thinking budget
-        planner_llm = init_chat_model(
-            model=planner_model, model_provider=planner_provider,
-            max_tokens=20_000,
-            temperature=0.0,
-            thinking={"type": "enabled", "budget_tokens": 16_000}
-        )
-    else:
-        planner_llm = init_chat_model(
-            model=planner_model, model_provider=planner_provider
-        )
-
-    structured_llm = planner_llm.with_structured_output(Sections)
-    report_sections = planner_llm.invoke([
+    # The thinking budget, if any, comes from configuration.thinking_budgets["planner"]
+    report_sections = await ainvoke_node("planner", [
         SystemMessage(content=system_instructions_sections),
         HumanMessage(content=planner_message)
-    ])
+    ], configuration, config, schema=Sections)
 
     sections = report_sections.sections
-    return {"sections": sections}
+    return {"sections": sections, "planning_source_refs": planning_source_refs}
 
 
 def human_feedback(state: ReportState, config: RunnableConfig) -> Command[Literal["generate_report_plan", "build_section_with_web_search"]]:
@@ -119,8 +165,9 @@ def human_feedback(state: ReportState, config: RunnableConfig) -> Command[Litera
     1. Formats the current report plan for human review
     2. Gets the feedback via an interrupt
     3. Routes to either:
-        - generate_report_plan if the feedback is positive
-        - build_section_with_web_search if any improvements are needed
+        - build_section_with_web_search if the plan is approved, seeding each section
+          with the planning sources most relevant to it
+        - generate_report_plan if any improvements are needed
     
     Args:
         state: Current state with report details
@@ -145,10 +192,25 @@ def human_feedback(state: ReportState, config: RunnableConfig) -> Command[Litera
 
     feedback = interrupt(interrupt_message)
     if isinstance(feedback, bool) and feedback is True:
-        return Command(goto=[
-            Send("build_section_with_web_search", {"topic": topic, "sections": sec, "search_iterations":0}) 
-            for sec in sections if sec.research
-        ])
+        configurable = Configuration.from_runnable_config(config)
+        run_id = bind_run(config)
+        corpus = get_run_corpus(run_id, configurable.corpus_path)
+        start_report_assembler([sec.name for sec in sections], run_id)
+        sends = []
+        for sec in sections:
+            if not sec.research:
+                continue
+            seed_refs, seed_coverage = select_seed_sources(
+                sec, corpus, state.get("planning_source_refs", []), configurable.seed_sources_per_section
+            )
+            sends.append(Send("build_section_with_web_search", {
+                "topic": topic,
+                "section": sec,
+                "search_iterations": 0,
+                "source_refs": seed_refs,
+                "seed_coverage": seed_coverage
+            }))
+        return Command(goto=sends)
     
     elif isinstance(feedback, str):
         return Command(goto="generate_report_plan", update={"feedback_on_report_plan": feedback})
@@ -158,15 +220,113 @@ def human_feedback(state: ReportState, config: RunnableConfig) -> Command[Litera
     
 
 
-def write_section(state: SectionState, config: RunnableConfig) -> Command:
+def format_section_sources(state: SectionState, configurable: Configuration, corpus: Corpus) -> str:
+    """Format the corpus documents referenced by the section into its source context.
+
+    The section's sources accumulate over its search iterations; they are deduplicated,
+    ranked and packed into the configured token budget, with passages ranked against
+    the section description and its latest search queries.
+    """
+    query_list = [query.search_query for query in state.get("search_queries", [])]
+    return format_sources(
+        [document.to_source() for document in corpus.get_many(state.get("source_refs", []))],
+        configurable.max_tokens_per_source,
+        max_total_tokens=configurable.max_context_tokens,
+        tokenizer=get_tokenizer(configurable.tokenizer),
+        relevance_query="\n".join([state["section"].description, *query_list]),
+        max_passages_per_source=configurable.max_passages_per_source,
+        near_duplicate_distance=configurable.near_duplicate_distance
+    )
+
+
+async def draft_section(system: List[PromptBlock], human: List[PromptBlock], section: Section, iteration: int,
+                        node: str, configurable: Configuration, config: RunnableConfig) -> str:
+    """Writes a draft of a section, streaming its tokens to the caller when `stream_tokens` is set.
+
+    Args:
+        system: The blocks of the writer's system prompt
+        human: The blocks of the writer's human prompt
+        section: The section being written
+        iteration: The search iteration the draft is based on
+        node: The name of the model call, see `llm_cache.LLM_CACHE_NODES`
+        configurable: The run configuration
+        config: The node's config
+
+    Returns:
+        The section content
+    """
+    emit_progress(section, "writing", iteration)
+    if configurable.stream_tokens:
+        # Streamed tokens have already reached the caller, so only the first model of the cascade is used
+        spec = configurable.model_cascade(node)[0]
+        async with track_call("llm", node, configurable.model_prices):
+            response = await astream_model(
+                get_chat_model(spec.provider, spec.model, **spec.kwargs),
+                build_messages(spec.provider, system, human),
+                token_emitter(section, iteration),
+                timeout=configurable.llm_timeout,
+                config=config,
+                cache=get_llm_cache(configurable, node),
+                node=node,
+                bypass_cache=configurable.llm_cache_bypass
+            )
+    else:
+        response = await ainvoke_node(node, lambda provider: build_messages(provider, system, human), configurable, config)
+    return message_text(response)
+
+
+async def grade_sections(requests: List[GradeRequest]) -> Dict[str, Feedback]:
+    """Grade the drafts of several sections of a report with one structured model call.
+
+    The call uses the settings the requests share and the node config of the first of them.
+
+    Args:
+        requests: The sections to grade, all of the same report and with the same settings
+
+    Returns:
+        The feedback per section name, for the sections the model graded
+    """
+    # The batch runs in its own task, which would otherwise be tagged with the section that started it
+    tag_calls()
+    human = [(f"<Report topic>\n{requests[0].topic}\n</Report topic>\n", False)] + [
+        (batch_grader_section.format(
+            section_name=request.section.name,
+            number_of_follow_up_queries=request.number_of_follow_up_queries,
+            section_topic=request.section.description,
+            section=request.section.content
+        ), False)
+        for request in requests
+    ]
+    grades = await ainvoke_node(
+        "section_grader_batch",
+        lambda provider: build_messages(provider, [(batch_grader_instructions, False)], human),
+        requests[0].configurable, requests[0].config, schema=SectionGrades
+    )
+
+    limits = {request.section.name: request.number_of_follow_up_queries for request in requests}
+    feedbacks = {}
+    for grade in grades.grades:
+        if grade.section in limits:
+            grade.feedback.follow_up_queries = grade.feedback.follow_up_queries[:limits[grade.section]]
+            feedbacks[grade.section] = grade.feedback
+    return feedbacks
+
+
+async def write_section(state: SectionState, config: RunnableConfig) -> Command:
     """Write a section of the report and evaluate if more research is needed.
     
     This node:
-    1. Writes the section content using search results.
-    2. Evaluates the quality of the section
-    3. Either:
-        - Completes the section if quality passes
-        - Triggers more research if quality fails
+    1. Completes the section as is if the last search round found no new sources
+    2. Writes the section content using the sources of all search iterations so far.
+    3. Completes the section without grading once the search depth is spent or the
+       last search round added few new passages
+    4. Evaluates the quality of the section, asking for more follow-up queries the
+       less the sources cover the section
+       (together with other sections drafted at the same time when `batch_grading` is set)
+       With `speculative_search`, likely follow-up searches run meanwhile
+    5. Either:
+        - Completes the section if quality passes, discarding any prefetched searches
+        - Triggers more research if quality fails, starting from the prefetched searches
 
     Args:
         state: Current state with section details
@@ -178,67 +338,168 @@ def write_section(state: SectionState, config: RunnableConfig) -> Command:
 
     topic = state["topic"]
     section = state["section"]
-    source_str = state["source_str"]
+    search_iterations = state["search_iterations"]
 
     configurable = Configuration.from_runnable_config(config)
+    run_id = bind_run(config)
+    tag_calls(section.name, search_iterations)
+
+    # A search round that found nothing new cannot improve the existing draft
+    if search_iterations > 0 and section.content and state.get("new_sources", 1) == 0:
+        section_completed(section, search_iterations)
+        return Command(
+            update={"completed_sections":[section]},
+            goto=END
+        )
+
+    corpus = get_run_corpus(run_id, configurable.corpus_path)
+    source_str = await asyncio.to_thread(format_section_sources, state, configurable, corpus)
     
-    section_writer_inputs_formatted = section_writer_inputs.format(
-        topic=topic,
-        section_name=section.name,
-        section_topic=section.description,
-        context=source_str,
-        section_content=section.content
+    # Stable to volatile: instructions shared by all sections, then this round's sources, then the draft.
+    # Nothing is flagged for caching: the instructions are shorter than the shortest prefix providers
+    # cache, and the sources after them change every round
+    section.content = await draft_section(
+        system=[(section_writer_instructions, False)],
+        human=[
+            (section_writer_context.format(
+                topic=topic,
+                section_name=section.name,
+                section_topic=section.description,
+                context=source_str
+            ), False),
+            (section_writer_draft.format(section_content=section.content), False)
+        ],
+        section=section,
+        iteration=search_iterations,
+        node="section_writer",
+        configurable=configurable,
+        config=config
     )
 
-    writer_provider = get_config_value(configurable.writer_provider)
-    writer_model_name = get_config_value(configurable.writer_model)
-    writer_model = init_chat_model(model=writer_model_name, model_provider=writer_provider)
-
-    section_content = writer_model.invoke([
-        SystemMessage(content=section_writer_instructions),
-        HumanMessage(content=section_writer_inputs_formatted)
-    ])
+    # Grading cannot lead anywhere once the search depth is spent or searching has stopped turning up new material
+    low_novelty = search_iterations > 0 and state.get("novelty", 1.0) < configurable.novelty_threshold
+    if low_novelty or search_iterations >= configurable.max_search_depth:
+        section_completed(section, search_iterations)
+        return Command(
+            update={"completed_sections":[section]},
+            goto=END
+        )
 
-    section.content = section_content.content
+    # Ask for more follow-up queries the less of the section the sources cover
+    coverage = await asyncio.to_thread(section_coverage, section, corpus.get_many(state.get("source_refs", [])))
+    number_of_follow_up_queries = min(configurable.number_of_queries, max(1, math.ceil((1 - coverage) * configurable.number_of_queries)))
 
-    section_grader_message = ("Grade the report and consider follow-up questions for missing information.",
-                              "If the grade is 'pass', return empty strings for any follow up queries", 
-                              "If the grade is 'fail', provide specific search queries to gather missing information.")
-    
-    section_grader_instructions_formatted = section_grader_instructions.format(
+    # The grading instructions are the same for every section and iteration, only the section itself varies.
+    # They are too short for providers to cache, so the prompt is not flagged for caching
+    grader_inputs = section_grader_inputs.format(
         topic=topic,
         section_topic=section.description,
         section=section.content,
-        number_of_follow_up_queries=configurable.number_of_follow_up_queries
+        number_of_follow_up_queries=number_of_follow_up_queries
     )
 
-    planner_provider = get_config_value(configurable.planner_provider)
-    planner_model = get_config_value(configurable.planner_model)
-
-    if planner_model == "claude-3.7-sonnel-latest":
-        reflection_model = init_chat_model(
-            model=planner_model, model_provider=planner_provider,
-            max_tokens=20_000,
-            temperature=0.0,
-            thinking={"type": "enabled", "budget_tokens": 16_000}
-        ).with_structured_output(Feedback)
-    else:
-        reflection_model = init_chat_model(model=planner_model, model_provider=planner_provider).with_structured_output(Feedback)
-    
-    feedback = reflection_model.invoke([
-        SystemMessage(content=section_grader_instructions_formatted), 
-        HumanMessage(content=section_grader_message)])
+    # Start likely follow-up searches while the grader runs, their results are only used if the section fails
+    speculation = None
+    if configurable.speculative_search:
+        candidates = await asyncio.to_thread(
+            speculative_queries, section, corpus.get_many(state.get("source_refs", [])), number_of_follow_up_queries
+        )
+        if candidates:
+            speculation = asyncio.ensure_future(
+                search_section(state, configurable, run_id, candidates, priority=search_iterations + 1)
+            )
+
+    emit_progress(section, "grading", search_iterations)
+    try:
+        feedback = None
+        if configurable.batch_grading:
+            batcher = get_grade_batcher(lambda: GradeBatcher(
+                grade_sections,
+                configurable.grading_batch_window,
+                configurable.grading_batch_size
+            ), run_id)
+            feedback = await batcher.grade(
+                GradeRequest(topic, section, number_of_follow_up_queries, configurable, config)
+            )
+        if feedback is None:
+            feedback = await ainvoke_node(
+                "section_grader",
+                lambda provider: build_messages(provider, [(section_grader_instructions, False)], [(grader_inputs, False)]),
+                configurable, config, schema=Feedback
+            )
+    except BaseException:
+        if speculation is not None:
+            speculation.cancel()
+        raise
     
-    if feedback.grade == 'pass' or state['search_iterations'] >= configurable.max_search_depth:
+    if feedback.grade == 'pass':
+        if speculation is not None:
+            speculation.cancel()
+        section_completed(section, search_iterations)
         return Command(
             update={"completed_sections":[section]},
             goto=END
         )
-    else:
-        return Command(
-            update={"search_iterations": feedback.follow_up_queries, "section": section},
-            goto="search_web"
-        )
+
+    follow_up_queries = feedback.follow_up_queries[:number_of_follow_up_queries]
+    if speculation is not None:
+        return await follow_up_with_prefetch(section, follow_up_queries, speculation, candidates, search_iterations, configurable)
+
+    emit_progress(section, "follow_up", search_iterations, queries=len(follow_up_queries))
+    return Command(
+        update={"search_queries": follow_up_queries, "section": section},
+        goto="search_web"
+    )
+
+
+async def follow_up_with_prefetch(section: Section, follow_up_queries: List[SearchQuery], speculation: asyncio.Future,
+                                  candidates: List[str], search_iterations: int, configurable: Configuration) -> Command:
+    """Continue a failed section using the searches started speculatively during grading.
+
+    The prefetched round replaces the follow-up search when it turned up enough new
+    material or when it already covers every follow-up query the grader asked for.
+    Otherwise its sources are kept and only the follow-up queries it does not cover are searched.
+
+    Args:
+        section: The failed section
+        follow_up_queries: The grader's follow-up queries
+        speculation: The prefetch task, resolving to the state update of its search round
+        candidates: The prefetched queries
+        search_iterations: The section's search iterations before the prefetch
+        configurable: The run configuration
+
+    Returns:
+        Command to redraft the section or to search the remaining queries
+    """
+    try:
+        prefetched = await speculation
+    except Exception as e:
+        logger.warning(f"Speculative search for section {section.name} failed: {e}")
+        prefetched = {}
+
+    remaining = [
+        query for query in follow_up_queries
+        if max(query_overlap(query.search_query, candidate) for candidate in candidates) < SPECULATION_MATCH
+    ]
+    if "source_refs" in prefetched:
+        novel = prefetched["new_sources"] > 0 and prefetched["novelty"] >= configurable.novelty_threshold
+        if novel or not remaining:
+            emit_progress(section, "follow_up", search_iterations, queries=0, prefetched=len(candidates))
+            return Command(
+                update={
+                    **prefetched,
+                    "search_queries": [SearchQuery(search_query=candidate) for candidate in candidates],
+                    "section": section
+                },
+                goto="write_section"
+            )
+        prefetched = {"source_refs": prefetched["source_refs"], "queries_issued": prefetched["queries_issued"]}
+
+    emit_progress(section, "follow_up", search_iterations, queries=len(remaining))
+    return Command(
+        update={**prefetched, "search_queries": remaining or follow_up_queries, "section": section},
+        goto="search_web"
+    )
 
 
 def format_sections(sections: list[Section]) -> str:
@@ -277,7 +538,7 @@ def gather_completed_sections(state: ReportState):
     return {"report_sections_from_research": completed_section}
 
 
-def write_final_sections(state: SectionState, config: RunnableConfig):
+async def write_final_sections(state: SectionState, config: RunnableConfig):
     """Write sections that dont require research using completed sections as context.
     This node handles sections such as conclusions or summaries that build on the researched sections
     rather than requiring new research.
@@ -290,45 +551,50 @@ def write_final_sections(state: SectionState, config: RunnableConfig):
         Dict containing the completed report"""
     
     configurable = Configuration.from_runnable_config(config)
+    bind_run(config)
     topic = state["topic"]
     section = state["section"]
+    tag_calls(section.name, 0)
     completed_report_sections = state["report_sections_from_research"]
 
-    system_instructions = final_section_writer_instructions.format(
-        topic=topic,
-        section_name=section.name,
-        section_topic=section.description,
-        context=completed_report_sections
+    # The completed research sections are the same for every final section of the report; with the
+    # instructions before them they make the one prefix long enough for providers to cache
+    section.content = await draft_section(
+        system=[(final_section_writer_instructions, False)],
+        human=[
+            (final_section_writer_context.format(topic=topic, context=completed_report_sections), True),
+            (final_section_writer_inputs.format(section_name=section.name, section_topic=section.description), False)
+        ],
+        section=section,
+        iteration=0,
+        node="final_section_writer",
+        configurable=configurable,
+        config=config
     )
-
-    writer_provider = get_config_value(configurable.writer_provider)
-    writer_model_name = get_config_value(configurable.writer_model)
-    writer_model = init_chat_model(model=writer_model_name, model_provider=writer_provider)
-
-    section_content = writer_model.invoke([
-        SystemMessage(content=system_instructions),
-        HumanMessage(content="Generate a report section based on the provided sources")
-    ])
-
-    section.content = section_content.content
+    section_completed(section)
 
     return {"completed_sections": [section]}
 
 
 
-def compile_final_report(state: ReportState):
+async def compile_final_report(state: ReportState, config: RunnableConfig):
     """Compile all sections into the final report.
     
     This node:
     1. Gets all completed sections
     2. Orders them according to original plan
     3. Combines them into the final report
+    4. Summarizes the time, tokens, retries and estimated cost of the run's model and search
+       calls per node, and appends the call records to `accounting_path` if set
+    5. Releases the per-run corpus, search budget, report assembler, grade batcher,
+       call records and the run's hold on the pooled http session
     
     Args:
         state: Current state with all completed sections
+        config: Configuration identifying the run
         
     Returns:
-        Dict containing the complete report
+        Dict containing the complete report and the run summary
     """
     sections = state["sections"]
     completed_sections = {s.name: s.content for s in state["completed_sections"]}
@@ -336,8 +602,38 @@ def compile_final_report(state: ReportState):
         section.content = completed_sections[section.name]
     
     all_sections = "\n\n".join([s.content for s in sections])
+    run_id = get_run_id(config)
+    # Closing writes the corpus' last changes to sqlite
+    await asyncio.to_thread(release_run_corpus, run_id)
+    release_run_search_budget(run_id)
+    release_report_assembler(run_id)
+    release_grade_batcher(run_id)
+    await release_http_session(run_id)
+
+    run_summary = summarize_run(run_id)
+    flight = get_search_flight()
+    run_summary["search_flight"] = flight.get_stats(run_id)
+    flight.release_stats(run_id)
+    logger.info(f"{run_summary['search_flight']['shared']} duplicate searches saved by sharing in-flight requests")
+    run_summary["dedup"] = get_dedup_stats(run_id)
+    release_dedup_stats(run_id)
+    logger.info(
+        f"Removed {run_summary['dedup']['removed']} near-duplicate sources from prompts, "
+        f"saving ~{run_summary['dedup']['tokens_saved']} tokens"
+    )
+    for node, usage in run_summary["by_node"].items():
+        logger.info(
+            f"{node}: {usage['calls']} calls in {usage['wall_time']:.1f}s, {usage['input_tokens']} input tokens "
+            f"({usage['cache_hit_rate']:.0%} from the prompt cache), {usage['output_tokens']} output tokens, "
+            f"{usage['queries']} search queries ({usage['reused_queries']} more reused), {usage['retries']} retries, "
+            f"${usage['cost']:.4f}"
+        )
+    configurable = Configuration.from_runnable_config(config)
+    if configurable.accounting_path:
+        export_call_records(configurable.accounting_path, run_id)
+    release_call_records(run_id)
 
-    return {"final_report": all_sections}
+    return {"final_report": all_sections, "run_summary": run_summary}
 
 
 def initiate_final_section_writing(state: ReportState):
@@ -1,12 +1,134 @@
+import asyncio
 from langchain_core.runnables import RunnableConfig
 from langchain_core.messages import SystemMessage, HumanMessage
-from state import SectionState, Queries
-from search.search_utils import select_and_execute_search
+from typing import List, Tuple
+from state import SectionState, Queries, Section
+from search.search_utils import execute_search
+from search.cache import get_search_cache
+from search.corpus import Corpus, Document, get_run_corpus
+from search.ranking import rank_passages, split_passages, tokenize
+from search.budget import get_run_search_budget
+from search.fetch_scheduler import fetch_priority
+from search.http_session import hold_http_session
 from configuration import Configuration
-from utils import get_config_value, get_search_params
+from utils import get_config_value, get_search_params, bind_run
 from prompts import query_writer_instructions
+from models import ainvoke_node
+from streaming import emit_progress
+from accounting import track_call, tag_calls
 
-def generate_queries(state: SectionState, config: RunnableConfig) -> Queries:
+def _section_query(section: Section) -> str:
+    return f"{section.name}\n{section.description}"
+
+
+def _best_passages(documents: List[Document], query: str, per_document: int = 3) -> List[List[Tuple[int, str, float]]]:
+    passages = rank_passages([document.raw_content or document.content for document in documents], query)
+    return [sorted(doc_passages, key=lambda p: -p[2])[:per_document] for doc_passages in passages]
+
+
+def _covered_terms(terms: set, best_passages: List[List[Tuple[int, str, float]]]) -> set:
+    covered = set()
+    for doc_passages in best_passages:
+        for _, passage, _ in doc_passages:
+            covered.update(terms.intersection(tokenize(passage)))
+    return covered
+
+
+def _coverage(terms: set, best_passages: List[List[Tuple[int, str, float]]]) -> float:
+    if not terms:
+        return 1.0
+    return len(_covered_terms(terms, best_passages)) / len(terms)
+
+
+def section_coverage(section: Section, documents: List[Document]) -> float:
+    """Share of the section's name and description terms that appear in the best passages of the documents."""
+    query = _section_query(section)
+    return _coverage(set(tokenize(query)), _best_passages(documents, query))
+
+
+def speculative_queries(section: Section, documents: List[Document], number_of_queries: int) -> List[str]:
+    """Guess follow-up search queries from the section terms the documents do not cover yet.
+
+    The uncovered terms of the section name and description, in their original order,
+    are spread over up to `number_of_queries` queries, each prefixed with the section name.
+
+    Returns:
+        The candidate queries, empty when the documents cover every term
+    """
+    query = _section_query(section)
+    covered = _covered_terms(set(tokenize(query)), _best_passages(documents, query))
+    name_terms = set(tokenize(section.name))
+    uncovered = []
+    for term in tokenize(section.description):
+        if term not in covered and term not in name_terms and term not in uncovered:
+            uncovered.append(term)
+    if not uncovered or number_of_queries <= 0:
+        return []
+    groups = [uncovered[i::number_of_queries][:4] for i in range(number_of_queries)]
+    return [f"{section.name} {' '.join(group)}" for group in groups if group]
+
+
+def query_overlap(a: str, b: str) -> float:
+    """Jaccard similarity of the terms of two search queries."""
+    terms_a, terms_b = set(tokenize(a)), set(tokenize(b))
+    if not terms_a or not terms_b:
+        return 0.0
+    return len(terms_a & terms_b) / len(terms_a | terms_b)
+
+
+def passage_fingerprints(documents: List[Document]) -> set:
+    """Fingerprints of the documents' passages, insensitive to case, punctuation and stopwords."""
+    return {
+        hash(" ".join(tokenize(passage)))
+        for document in documents
+        for passage in split_passages(document.raw_content or document.content)
+    }
+
+
+def passage_novelty(known: List[Document], retrieved: List[Document]) -> float:
+    """Share of the retrieved documents' passages that none of the known documents has."""
+    retrieved_passages = passage_fingerprints(retrieved)
+    if not retrieved_passages:
+        return 0.0
+    return len(retrieved_passages - passage_fingerprints(known)) / len(retrieved_passages)
+
+
+def select_seed_sources(section: Section, corpus: Corpus, source_refs: List[str], top_k: int) -> Tuple[List[str], float]:
+    """Rank the planning sources against a section to seed its first iteration.
+
+    Coverage is the share of the section's name and description terms that appear
+    in the best passages of the selected sources.
+
+    Args:
+        section: The section to seed
+        corpus: The run corpus holding the planning sources
+        source_refs: Corpus ids of the planning sources
+        top_k: Number of sources to keep
+
+    Returns:
+        The ids of the best matching sources, best first, and their coverage between 0 and 1
+    """
+    documents = corpus.get_many(source_refs)
+    section_query = _section_query(section)
+    terms = set(tokenize(section_query))
+    if not documents or not terms or top_k <= 0:
+        return [], 0.0
+
+    best = _best_passages(documents, section_query)
+    ranked = sorted(range(len(documents)), key=lambda i: -sum(score for _, _, score in best[i]))
+    seeds = [i for i in ranked[:top_k] if any(score > 0 for _, _, score in best[i])]
+    return [documents[i].doc_id for i in seeds], _coverage(terms, [best[i] for i in seeds])
+
+
+def route_section_start(state: SectionState, config: RunnableConfig) -> str:
+    """Skip the first search round of sections whose seed sources already cover them."""
+    configurable = Configuration.from_runnable_config(config)
+    if state.get("source_refs") and state.get("seed_coverage", 0.0) >= configurable.seed_coverage_threshold:
+        return "write_section"
+    return "generate_queries"
+
+
+async def generate_queries(state: SectionState, config: RunnableConfig):
     """Generate search queries for researching a specific section.
     
     This node uses an LLM to generate targeted search queries based on the 
@@ -24,17 +146,15 @@ def generate_queries(state: SectionState, config: RunnableConfig) -> Queries:
 
     configurable = Configuration.from_runnable_config(config)
     number_of_queries = configurable.number_of_queries
-    writer_provider = get_config_value(configurable.writer_provider)
-    writer_model = get_config_value(configurable.writer_model)
+    tag_calls(section.name, state["search_iterations"])
 
-    structured_llm = writer_model.with_structured_output(Queries)
     system_instructions = query_writer_instructions.format(topic=topic, section_topic=section.description, number_of_queries=number_of_queries)
-    queries = structured_llm.invoke(
+    queries = await ainvoke_node("query_writer", [
         SystemMessage(content=system_instructions),
         HumanMessage(content="Generate search queries on the provided topic.")
-    )
+    ], configurable, config, schema=Queries)
 
-    return queries
+    return {"search_queries": queries.queries}
 
 
 async def search_web(state: SectionState, config: RunnableConfig):
@@ -43,23 +163,74 @@ async def search_web(state: SectionState, config: RunnableConfig):
     This node:
     1. Takes the generated queries
     2. Executes searches using configured search API
-    3. Formats results into usable context
+    3. Stores the results in the run corpus
+    4. Measures the novelty of the results against the section's existing sources
     
     Args:
         state: Current state with search queries
         config: Search API configuration
         
     Returns:
-        Dict with search results and updated iteration count
+        Dict with the corpus ids of the new results, updated iteration and query counts,
+        and the number of new sources and share of new passages
     """
 
-    search_queries = state["search_queries"]
+    run_id = bind_run(config)
     configurable = Configuration.from_runnable_config(config)
+    query_list = [query.search_query for query in state["search_queries"]]
+    # Serve page fetches of a section's first searches before those of follow-up iterations
+    return await search_section(state, configurable, run_id, query_list, priority=state["search_iterations"])
+
+
+async def search_section(state: SectionState, configurable: Configuration, run_id: str,
+                         query_list: List[str], priority: int) -> dict:
+    """Run one search round for a section and measure what it added.
+
+    Args:
+        state: The section state before the round
+        configurable: The run configuration
+        run_id: The run, see `utils.get_run_id`
+        query_list: The queries to search
+        priority: The page fetch priority of the round, lower is served first
+
+    Returns:
+        The section state update of the round
+    """
+    # A run resumed after plan approval may be running on a new event loop
+    hold_http_session(run_id)
     search_api = get_config_value(configurable.search_api)
     search_api_config = configurable.search_api_config or {}
     search_params = get_search_params(search_api, search_api_config)
-    query_list = [query.search_query for query in search_queries]
-    source_str = await select_and_execute_search(search_api, query_list, search_params)
-    
-    return {"source_str": source_str, "search_iterations":state["search_iteration"]+ 1}
+    search_cache = get_search_cache(configurable)
+    corpus = get_run_corpus(run_id, configurable.corpus_path)
+
+    # Respect the per-section and per-run query budgets
+    queries_issued = state.get("queries_issued", 0)
+    if configurable.max_section_search_queries is not None:
+        query_list = query_list[:max(0, configurable.max_section_search_queries - queries_issued)]
+    granted = get_run_search_budget(run_id, configurable.max_run_search_queries).take(len(query_list))
+    query_list = query_list[:granted]
+    if not query_list:
+        return {"search_iterations": state["search_iterations"] + 1, "new_sources": 0, "novelty": 0.0}
 
+    emit_progress(state["section"], "searching", state["search_iterations"], queries=len(query_list))
+    fetch_priority.set(priority)
+    # Tagged with the iteration the results are for, also when prefetched during grading
+    tag_calls(state["section"].name, priority)
+    async with track_call("search", search_api, configurable.search_prices):
+        search_results = await execute_search(search_api, query_list, search_params, search_cache)
+    # Added to the sources of earlier iterations (and the planning seeds) by the state reducer
+    source_refs = await asyncio.to_thread(corpus.add_responses, search_results)
+
+    # Measure how much of what was retrieved the section did not have yet
+    known_refs = set(state.get("source_refs", []))
+    novelty = await asyncio.to_thread(passage_novelty, corpus.get_many(list(known_refs)), corpus.get_many(source_refs))
+    new_sources = [ref for ref in source_refs if ref not in known_refs]
+    
+    return {
+        "source_refs": source_refs,
+        "search_iterations": state["search_iterations"] + 1,
+        "queries_issued": queries_issued + len(query_list),
+        "new_sources": len(new_sources),
+        "novelty": novelty
+    }
@@ -0,0 +1,44 @@
+import threading
+from typing import Dict, Optional
+from utils import current_run_id
+
+
+class SearchBudget:
+    """Number of search queries a run may still issue. A limit of None never runs out."""
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self, requested: int) -> int:
+        """Reserves up to `requested` queries and returns how many were granted."""
+        with self._lock:
+            granted = requested if self.limit is None else max(0, min(requested, self.limit - self.used))
+            self.used += granted
+            return granted
+
+
+_budgets: Dict[str, SearchBudget] = {}
+_budgets_lock = threading.Lock()
+
+
+def get_run_search_budget(run_id: Optional[str] = None, limit: Optional[int] = None) -> SearchBudget:
+    """Returns the search budget of the given run, by default the run of the current context.
+
+    Args:
+        run_id: The run, see `utils.get_run_id`
+        limit: Total queries allowed in the run, only used when the budget is created
+    """
+    run_id = run_id or current_run_id.get()
+    with _budgets_lock:
+        budget = _budgets.get(run_id)
+        if budget is None:
+            budget = _budgets[run_id] = SearchBudget(limit)
+        return budget
+
+
+def release_run_search_budget(run_id: Optional[str] = None):
+    """Forgets the search budget of a finished run."""
+    with _budgets_lock:
+        _budgets.pop(run_id or current_run_id.get(), None)
@@ -0,0 +1,249 @@
+import os
+import copy
+import asyncio
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict, Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 60 * 60
+
+# How long a cached response stays fresh for each search API, in seconds.
+DEFAULT_SEARCH_CACHE_TTLS = {
+    "tavily": 6 * 60 * 60,
+    "exa": 24 * 60 * 60,
+    "google": 6 * 60 * 60,
+}
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes a search query so trivially different spellings share a cache entry."""
+    query = unicodedata.normalize("NFKC", query)
+    return " ".join(query.lower().split())
+
+
+def make_cache_key(search_api: str, query: str, search_params: Optional[Dict[str, Any]]) -> str:
+    """Builds the cache key for one query sent to one search API with the given (filtered) params."""
+    payload = json.dumps(
+        [search_api, normalize_query(query), search_params or {}],
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    evictions: int = 0
+    writes: int = 0
+
+
+class SearchCache(ABC):
+    """Base class for search result caches.
+
+    Values are single search responses (one per query) as returned by the search backends.
+    Subclasses implement `_get`, `_set` and `__len__`; the hit/miss accounting lives here.
+    Caches whose lookups block on I/O set `blocking`, so the async accessors run them
+    in a worker thread.
+    """
+
+    blocking = False
+
+    def __init__(self, ttls: Optional[Dict[str, int]] = None):
+        self.ttls = {**DEFAULT_SEARCH_CACHE_TTLS, **(ttls or {})}
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+
+    def ttl_for(self, search_api: str) -> int:
+        return self.ttls.get(search_api, DEFAULT_TTL)
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            value = self._get(key, time.time())
+            if value is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+            return value
+
+    def set(self, key: str, value: dict, search_api: str):
+        ttl = self.ttl_for(search_api)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._set(key, value, search_api, time.time() + ttl)
+            self.stats.writes += 1
+
+    async def aget_many(self, keys: List[str]) -> List[Optional[dict]]:
+        """Looks up several keys without blocking the event loop."""
+        if self.blocking:
+            return await asyncio.to_thread(lambda: [self.get(key) for key in keys])
+        return [self.get(key) for key in keys]
+
+    async def aset_many(self, items: List[Tuple[str, dict]], search_api: str):
+        """Stores several responses without blocking the event loop."""
+        if not items:
+            return
+        if self.blocking:
+            await asyncio.to_thread(lambda: [self.set(key, value, search_api) for key, value in items])
+            return
+        for key, value in items:
+            self.set(key, value, search_api)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**asdict(self.stats), "size": len(self)}
+
+    @abstractmethod
+    def _get(self, key: str, now: float) -> Optional[dict]:
+        """Returns the value stored under `key` unless it expired before `now`."""
+
+    @abstractmethod
+    def _set(self, key: str, value: dict, search_api: str, expires_at: float):
+        """Stores `value` under `key` until `expires_at`."""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """The number of stored entries."""
+
+
+class MemorySearchCache(SearchCache):
+    """In-process LRU cache."""
+
+    def __init__(self, max_entries: int = 2048, ttls: Optional[Dict[str, int]] = None):
+        super().__init__(ttls)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= now:
+            del self._entries[key]
+            self.stats.expired += 1
+            return None
+        self._entries.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def _set(self, key, value, search_api, expires_at):
+        self._entries[key] = (expires_at, copy.deepcopy(value))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteSearchCache(SearchCache):
+    """On-disk cache that survives restarts and is shared by every run using the same file.
+
+    Entries beyond `max_entries` are evicted least recently used first. Subclasses
+    caching something else in the same way set their own `table` and `label_column`.
+    """
+
+    blocking = True
+    table = "search_cache"
+    # The column storing the `search_api` passed to `set`
+    label_column = "search_api"
+
+    def __init__(self, path: str, max_entries: int = 2048, ttls: Optional[Dict[str, int]] = None):
+        super().__init__(ttls)
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self.table} (
+                key TEXT PRIMARY KEY,
+                {self.label_column} TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed_at)")
+        self._conn.commit()
+
+    def _get(self, key, now):
+        row = self._conn.execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at <= now:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+            self.stats.expired += 1
+            return None
+        self._conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        self._conn.commit()
+        return json.loads(value)
+
+    def _set(self, key, value, search_api, expires_at):
+        now = time.time()
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, {self.label_column}, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, search_api, json.dumps(value, default=str), expires_at, now)
+        )
+        self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,))
+        overflow = len(self) - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)",
+                (overflow,)
+            )
+            self.stats.evictions += overflow
+        self._conn.commit()
+
+    def __len__(self):
+        return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+_caches: Dict[tuple, SearchCache] = {}
+
+
+def get_search_cache(configurable) -> Optional[SearchCache]:
+    """Returns the process-wide search cache described by the configuration, or None if caching is disabled.
+
+    Args:
+        configurable: Configuration with the search_cache* fields
+
+    Returns:
+        The shared SearchCache instance for these settings
+    """
+    kind = (configurable.search_cache or "none").lower()
+    if kind == "none":
+        return None
+
+    ttls = configurable.search_cache_ttl or {}
+    max_entries = int(configurable.search_cache_max_entries)
+    cache_id = (kind, configurable.search_cache_path, max_entries, tuple(sorted(ttls.items())))
+    cache = _caches.get(cache_id)
+    if cache is None:
+        if kind == "memory":
+            cache = MemorySearchCache(max_entries=max_entries, ttls=ttls)
+        elif kind == "sqlite":
+            cache = SQLiteSearchCache(configurable.search_cache_path, max_entries=max_entries, ttls=ttls)
+        else:
+            raise ValueError(f"Unsupported search cache: {kind}")
+        _caches[cache_id] = cache
+    return cache
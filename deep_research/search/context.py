@@ -0,0 +1,205 @@
+import sys
+import logging
+from abc import ABC, abstractmethod
+from typing import List, Optional
+from search.ranking import rank_passages, select_passages
+
+logger = logging.getLogger(__name__)
+
+
+class Tokenizer(ABC):
+    """Counts and truncates text in model tokens."""
+
+    @abstractmethod
+    def count(self, text: str) -> int:
+        """The number of tokens in `text`."""
+
+    @abstractmethod
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """The longest prefix of `text` that fits in `max_tokens` tokens."""
+
+
+class ApproximateTokenizer(Tokenizer):
+    """Estimates tokens from the character count. Fast and dependency free."""
+
+    def __init__(self, chars_per_token: float = 4.0):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text: str) -> int:
+        return int(len(text) / self.chars_per_token + 0.5)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        return text[:int(max_tokens * self.chars_per_token)]
+
+
+class TiktokenTokenizer(Tokenizer):
+    """Exact counts for OpenAI style BPE encodings, a close estimate for other providers."""
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        import tiktoken
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max_tokens])
+
+
+_tokenizers = {}
+
+
+def get_tokenizer(name: str = "approximate") -> Tokenizer:
+    """Returns the tokenizer registered under `name`.
+
+    Args:
+        name: "approximate", "tiktoken" or "tiktoken:<encoding>". tiktoken is an optional
+            dependency; without it the approximate tokenizer is used.
+    """
+    tokenizer = _tokenizers.get(name)
+    if tokenizer is None:
+        if name.startswith("tiktoken"):
+            _, _, encoding_name = name.partition(":")
+            try:
+                tokenizer = TiktokenTokenizer(encoding_name or "cl100k_base")
+            except ImportError:
+                logger.warning("tiktoken is not installed, falling back to approximate token counts")
+                tokenizer = ApproximateTokenizer()
+        elif name == "approximate":
+            tokenizer = ApproximateTokenizer()
+        else:
+            raise ValueError(f"Unsupported tokenizer: {name}")
+        _tokenizers[name] = tokenizer
+    return tokenizer
+
+
+def _relevance_weights(sources: List[dict]) -> List[float]:
+    scores = [source.get("score") for source in sources]
+    known = [score for score in scores if isinstance(score, (int, float)) and score > 0]
+    default = sum(known) / len(known) if known else 1.0
+    return [score if isinstance(score, (int, float)) and score > 0 else default for score in scores]
+
+
+def allocate_budget(sizes: List[int], weights: List[float], budget: int, cap: Optional[int] = None) -> List[int]:
+    """Splits `budget` tokens across items in proportion to their weights.
+
+    No item gets more than its own size or `cap`; whatever an item cannot use is
+    redistributed among the others.
+    """
+    limits = [min(size, cap) if cap is not None else size for size in sizes]
+    allocation = [0] * len(sizes)
+    open_items = [i for i, limit in enumerate(limits) if limit > 0]
+    remaining = budget
+    while open_items and remaining > 0:
+        total_weight = sum(weights[i] for i in open_items)
+        spent = 0
+        still_open = []
+        for i in open_items:
+            share = max(1, int(remaining * weights[i] / total_weight))
+            grant = min(share, limits[i] - allocation[i], remaining - spent)
+            allocation[i] += grant
+            spent += grant
+            if allocation[i] < limits[i]:
+                still_open.append(i)
+        remaining -= spent
+        if spent == 0:
+            break
+        open_items = still_open
+    return allocation
+
+
+def pack_sources(
+        sources: List[dict],
+        max_total_tokens: Optional[int],
+        max_tokens_per_source: Optional[int] = None,
+        include_raw_content: bool = True,
+        tokenizer: Optional[Tokenizer] = None,
+        relevance_query: Optional[str] = None,
+        max_passages_per_source: Optional[int] = None
+        ) -> str:
+    """Formats sources into one context string that fits in a total token budget.
+
+    Sources are ranked by relevance score. Their title, URL and snippet are always kept
+    (lowest ranked sources are dropped when even those do not fit); the remaining budget
+    is split across the sources' raw content in proportion to their scores, capped at
+    `max_tokens_per_source` each.
+
+    With a `relevance_query`, raw content is not cut to its first tokens: each document is
+    split into passages, the passages are ranked against the query with BM25 and only the
+    best ones (at most `max_passages_per_source`) that fit the source's share are kept.
+
+    Args:
+        sources: Deduplicated search results with title, url, content, score and raw_content
+        max_total_tokens: Token budget for the whole string, None for no overall limit
+        max_tokens_per_source: Token cap for the raw content of a single source
+        include_raw_content: Whether to include raw content at all
+        tokenizer: Tokenizer used to measure the budget, defaults to the approximate one
+        relevance_query: Text to rank passages against, e.g. the section description and its queries
+        max_passages_per_source: Maximum number of passages kept per source when ranking passages
+
+    Returns:
+        str: Formatted string with the packed sources
+    """
+    tokenizer = tokenizer or get_tokenizer()
+    ranked = sorted(sources, key=lambda source: source.get("score") or 0, reverse=True)
+
+    headers = [
+        f"{'='*80}\n"
+        f"Source: {source['title']}\n"
+        f"{'-'*80}\n"
+        f"URL: {source['url']}\n===\n"
+        f"Most relevant content from source: {source['content']}\n===\n"
+        for source in ranked
+    ]
+    footer = f"{'='*80}\n\n"
+    overhead = tokenizer.count(footer) + (tokenizer.count("Full source content: \n\n") if include_raw_content else 0)
+
+    # Keep as many ranked sources as the budget allows
+    remaining = max_total_tokens
+    kept = []
+    for source, header in zip(ranked, headers):
+        cost = tokenizer.count(header) + overhead
+        if remaining is not None:
+            if cost > remaining:
+                break
+            remaining -= cost
+        kept.append((source, header))
+    if len(kept) < len(ranked):
+        logger.info(f"Context budget of {max_total_tokens} tokens dropped {len(ranked) - len(kept)} lowest ranked sources")
+
+    raw_contents = []
+    if include_raw_content:
+        for source, _ in kept:
+            raw_content = source.get("raw_content")
+            if raw_content is None:
+                raw_content = ""
+                logger.warning(f"No raw_content found for source {source['url']}")
+            raw_contents.append(raw_content)
+        if relevance_query:
+            passages = rank_passages(raw_contents, relevance_query)
+            # Size each source by its best passages only, so the budget goes to relevant text
+            sizes = [
+                tokenizer.count(select_passages(doc_passages, sys.maxsize, tokenizer.count, max_passages_per_source))
+                for doc_passages in passages
+            ]
+        else:
+            sizes = [tokenizer.count(raw_content) for raw_content in raw_contents]
+        budget = remaining if remaining is not None else sum(sizes)
+        allocation = allocate_budget(sizes, _relevance_weights([s for s, _ in kept]), budget, max_tokens_per_source)
+        for i, (raw_content, size, tokens) in enumerate(zip(raw_contents, sizes, allocation)):
+            if relevance_query:
+                raw_contents[i] = select_passages(passages[i], tokens, tokenizer.count, max_passages_per_source)
+            elif tokens < size:
+                raw_contents[i] = tokenizer.truncate(raw_content, tokens) + "... [truncated]"
+
+    parts = ["Content from sources:\n"]
+    for i, (_, header) in enumerate(kept):
+        parts.append(header)
+        if include_raw_content:
+            parts.append(f"Full source content: {raw_contents[i]}\n\n")
+        parts.append(footer)
+
+    return "".join(parts).strip()
@@ -0,0 +1,229 @@
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+from search.urls import canonicalize_url
+from utils import current_run_id
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Document:
+    doc_id: str
+    url: str
+    canonical_url: str
+    title: str
+    content: str
+    raw_content: Optional[str]
+    score: Optional[float]
+    content_hash: str
+
+    def to_source(self) -> dict:
+        """Returns the document in the search result format used by the formatters."""
+        return {
+            "title": self.title,
+            "url": self.url,
+            "content": self.content,
+            "score": self.score,
+            "raw_content": self.raw_content
+        }
+
+
+# Stand-ins the backends put in raw_content when a page could not be extracted (see search.google)
+PLACEHOLDER_PREFIXES = ("[Binary content:", "[Could not decode content:", "[Error fetching content:")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(" ".join(text.split()).lower().encode("utf-8")).hexdigest()
+
+
+def is_page_text(raw_content: Optional[str]) -> bool:
+    """Whether raw_content holds extracted page text rather than nothing or a placeholder."""
+    return bool(raw_content) and not raw_content.startswith(PLACEHOLDER_PREFIXES)
+
+
+class Corpus:
+    """Documents retrieved during one run, shared by every section and search iteration.
+
+    Documents are keyed by canonical URL; a document whose page text is identical to
+    one already stored under another URL resolves to the existing document. Results
+    whose page could not be extracted are only matched by URL. Page text
+    fetched by the backends is kept as well so no page is downloaded twice in a run.
+    With a `path`, everything is also written to sqlite so an interrupted run can be
+    resumed without refetching. Changes are written in batches by `flush`, which
+    `add_responses` calls once per search; call both off the event loop.
+    """
+
+    def __init__(self, run_id: str, path: Optional[str] = None):
+        self.run_id = run_id
+        self.path = path
+        self._documents: Dict[str, Document] = {}
+        self._by_hash: Dict[str, str] = {}
+        self._pages: Dict[str, str] = {}
+        # Documents and pages changed since the last flush
+        self._dirty_documents: Dict[str, Document] = {}
+        self._dirty_pages: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents (run_id TEXT, doc_id TEXT, value TEXT, PRIMARY KEY (run_id, doc_id))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages (run_id TEXT, canonical_url TEXT, text TEXT, PRIMARY KEY (run_id, canonical_url))"
+            )
+            self._conn.commit()
+            self._load()
+
+    def _load(self):
+        for (value,) in self._conn.execute("SELECT value FROM documents WHERE run_id = ?", (self.run_id,)):
+            document = Document(**json.loads(value))
+            self._documents[document.doc_id] = document
+            self._by_hash.setdefault(document.content_hash, document.doc_id)
+        for canonical_url, text in self._conn.execute("SELECT canonical_url, text FROM pages WHERE run_id = ?", (self.run_id,)):
+            self._pages[canonical_url] = text
+
+    def _persist(self, document: Document):
+        if self._conn is not None:
+            self._dirty_documents[document.doc_id] = document
+
+    def flush(self):
+        """Writes the documents and pages changed since the last flush to sqlite in one transaction."""
+        with self._lock:
+            if self._conn is None or not (self._dirty_documents or self._dirty_pages):
+                return
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO documents (run_id, doc_id, value) VALUES (?, ?, ?)",
+                    [(self.run_id, doc_id, json.dumps(asdict(document))) for doc_id, document in self._dirty_documents.items()]
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO pages (run_id, canonical_url, text) VALUES (?, ?, ?)",
+                    [(self.run_id, canonical_url, text) for canonical_url, text in self._dirty_pages.items()]
+                )
+            self._dirty_documents.clear()
+            self._dirty_pages.clear()
+
+    def add(self, result: dict) -> str:
+        """Adds one search result and returns its document id."""
+        canonical_url = canonicalize_url(result["url"])
+        doc_id = hashlib.sha1(canonical_url.encode("utf-8")).hexdigest()[:16]
+        raw_content = result.get("raw_content")
+        if is_page_text(raw_content):
+            digest = content_hash(raw_content)
+        elif raw_content:
+            # Placeholders are the same for unrelated pages, e.g. every PDF or timed out fetch
+            digest = content_hash(canonical_url)
+        else:
+            digest = content_hash(result.get("content") or canonical_url)
+        with self._lock:
+            existing = self._documents.get(doc_id)
+            if existing is None:
+                duplicate = self._by_hash.get(digest)
+                if duplicate is not None:
+                    return duplicate
+                document = Document(
+                    doc_id=doc_id,
+                    url=result["url"],
+                    canonical_url=canonical_url,
+                    title=result.get("title") or "",
+                    content=result.get("content") or "",
+                    raw_content=raw_content,
+                    score=result.get("score"),
+                    content_hash=digest
+                )
+                self._documents[doc_id] = document
+                self._by_hash[digest] = doc_id
+            else:
+                # Keep the fullest text and the best score seen for the page
+                document = existing
+                if is_page_text(raw_content) and (
+                    not is_page_text(existing.raw_content) or len(raw_content) > len(existing.raw_content)
+                ):
+                    existing.raw_content = raw_content
+                    existing.content_hash = digest
+                    self._by_hash.setdefault(digest, doc_id)
+                score = result.get("score")
+                if isinstance(score, (int, float)) and (existing.score is None or score > existing.score):
+                    existing.score = score
+            self._persist(document)
+            return doc_id
+
+    def add_responses(self, search_responses: List[dict]) -> List[str]:
+        """Adds every result of the search responses and flushes, returning the distinct document ids in order."""
+        doc_ids = []
+        for response in search_responses:
+            for result in response.get("results", []):
+                doc_id = self.add(result)
+                if doc_id not in doc_ids:
+                    doc_ids.append(doc_id)
+        self.flush()
+        return doc_ids
+
+    def get(self, doc_id: str) -> Optional[Document]:
+        return self._documents.get(doc_id)
+
+    def get_many(self, doc_ids: List[str]) -> List[Document]:
+        return [self._documents[doc_id] for doc_id in doc_ids if doc_id in self._documents]
+
+    def get_page(self, url: str) -> Optional[str]:
+        """Returns the page text fetched earlier in the run for this URL, if any."""
+        return self._pages.get(canonicalize_url(url))
+
+    def set_page(self, url: str, text: str):
+        """Keeps fetched page text, written with the next flush, i.e. with the documents of its search."""
+        canonical_url = canonicalize_url(url)
+        with self._lock:
+            self._pages[canonical_url] = text
+            if self._conn is not None:
+                self._dirty_pages[canonical_url] = text
+
+    def __len__(self):
+        return len(self._documents)
+
+    def close(self):
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_corpora: Dict[str, Corpus] = {}
+_corpora_lock = threading.Lock()
+
+
+def get_run_corpus(run_id: Optional[str] = None, path: Optional[str] = None) -> Corpus:
+    """Returns the corpus of the given run, by default the run of the current context.
+
+    The corpus is created on first use, so the run should create it with its `path`
+    before anything else looks it up, e.g. the page fetcher of the first search.
+
+    Args:
+        run_id: The run, see `utils.get_run_id`
+        path: Optional sqlite file backing the corpus, only used when the corpus is created
+    """
+    run_id = run_id or current_run_id.get()
+    with _corpora_lock:
+        corpus = _corpora.get(run_id)
+        if corpus is None:
+            corpus = _corpora[run_id] = Corpus(run_id, path)
+        elif path and path != corpus.path:
+            logger.warning(f"Corpus of run {run_id} is already backed by {corpus.path or 'memory'}, ignoring {path}")
+        return corpus
+
+
+def release_run_corpus(run_id: Optional[str] = None):
+    """Forgets the in-memory corpus of a finished run. Disk backed documents are kept."""
+    with _corpora_lock:
+        corpus = _corpora.pop(run_id or current_run_id.get(), None)
+    if corpus is not None:
+        corpus.close()
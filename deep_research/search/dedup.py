@@ -0,0 +1,167 @@
+import re
+import hashlib
+import logging
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from utils import current_run_id
+from search.urls import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+FINGERPRINT_BITS = 64
+# Near duplicates within MAX_DISTANCE bits must agree on at least one of the bands
+BANDS = 4
+MIN_WORDS = 20
+
+
+@dataclass
+class DedupStats:
+    sources: int = 0
+    removed: int = 0
+    tokens_saved: int = 0
+    # Tokens saved by each removed source, by canonical URL
+    removed_urls: Dict[str, int] = field(default_factory=dict, repr=False)
+
+    def add(self, other: "DedupStats"):
+        """Adds the sources of another call, counting each removed URL only the first time it is removed."""
+        self.sources += other.sources
+        for url, tokens in other.removed_urls.items():
+            if url not in self.removed_urls:
+                self.removed_urls[url] = tokens
+                self.removed += 1
+                self.tokens_saved += tokens
+
+    def to_dict(self) -> Dict[str, int]:
+        return {"sources": self.sources, "removed": self.removed, "tokens_saved": self.tokens_saved}
+
+
+def simhash(text: str, shingle_size: int = 3) -> Optional[int]:
+    """64-bit SimHash of the text's word shingles, None for texts too short to fingerprint."""
+    words = _WORD.findall(text.lower())
+    if len(words) < MIN_WORDS:
+        return None
+    shingles = len(words) - shingle_size + 1
+    digests = b"".join(
+        hashlib.blake2b(" ".join(words[i:i + shingle_size]).encode("utf-8"), digest_size=8).digest()
+        for i in range(shingles)
+    )
+    # Count the set bits per position from the byte values of each digest column, so the
+    # per-bit work depends on the distinct byte values rather than the number of shingles
+    ones = [0] * FINGERPRINT_BITS
+    for column in range(8):
+        # Digests are big-endian, the first byte holds the highest bits
+        low_bit = (7 - column) * 8
+        for byte, count in Counter(digests[column::8]).items():
+            for bit in range(8):
+                if byte >> bit & 1:
+                    ones[low_bit + bit] += count
+    return sum(1 << bit for bit, count in enumerate(ones) if 2 * count > shingles)
+
+
+def _bands(fingerprint: int) -> List[Tuple[int, int]]:
+    width = FINGERPRINT_BITS // BANDS
+    mask = (1 << width) - 1
+    return [(band, fingerprint >> (band * width) & mask) for band in range(BANDS)]
+
+
+def _quality(source: dict) -> tuple:
+    score = source.get("score")
+    return (score if isinstance(score, (int, float)) else 0, len(source.get("raw_content") or ""))
+
+
+def remove_near_duplicates(
+        sources: List[dict],
+        max_distance: int = 3,
+        count_tokens=None,
+        max_tokens_per_source: Optional[int] = None
+        ) -> Tuple[List[dict], DedupStats]:
+    """Clusters sources whose content fingerprints are within `max_distance` bits and keeps the best of each cluster.
+
+    The representative is the source with the highest score, then the longest raw content.
+    Sources too short to fingerprint are always kept.
+
+    Args:
+        sources: Search results with url, content, score and raw_content
+        max_distance: Maximum Hamming distance between SimHash fingerprints of near duplicates, at most BANDS - 1
+        count_tokens: Function used to report the tokens saved, defaults to 4 characters per token
+        max_tokens_per_source: Token cap the prompt applies to each source, which also caps its tokens saved
+
+    Returns:
+        The kept sources in their original order, and what was removed
+    """
+    count_tokens = count_tokens or (lambda text: len(text) // 4)
+    max_distance = min(max_distance, BANDS - 1)
+    stats = DedupStats(sources=len(sources))
+
+    fingerprints = [simhash(source.get("raw_content") or source.get("content") or "") for source in sources]
+    parent = list(range(len(sources)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    buckets = {}
+    for i, fingerprint in enumerate(fingerprints):
+        if fingerprint is None:
+            continue
+        candidates = set()
+        for band in _bands(fingerprint):
+            candidates.update(buckets.setdefault(band, []))
+            buckets[band].append(i)
+        for j in candidates:
+            if bin(fingerprint ^ fingerprints[j]).count("1") <= max_distance:
+                parent[find(i)] = find(j)
+
+    best = {}
+    for i, source in enumerate(sources):
+        root = find(i)
+        if root not in best or _quality(source) > _quality(sources[best[root]]):
+            best[root] = i
+
+    kept = []
+    for i, source in enumerate(sources):
+        if best[find(i)] == i:
+            kept.append(source)
+        else:
+            tokens = count_tokens(source.get("raw_content") or source.get("content") or "")
+            if max_tokens_per_source is not None:
+                tokens = min(tokens, max_tokens_per_source)
+            stats.removed += 1
+            stats.tokens_saved += tokens
+            stats.removed_urls.setdefault(canonicalize_url(source.get("url") or ""), tokens)
+
+    if stats.removed:
+        logger.info(f"Removed {stats.removed} near-duplicate sources, saving ~{stats.tokens_saved} tokens")
+    return kept, stats
+
+
+_run_stats: Dict[str, DedupStats] = {}
+_run_stats_lock = threading.Lock()
+
+
+def record_dedup_stats(stats: DedupStats, run_id: Optional[str] = None):
+    """Adds what one call of `remove_near_duplicates` removed to the totals of its run.
+
+    A source removed again from a later prompt of the run, e.g. the next search iteration
+    of the same section, is not counted again.
+    """
+    with _run_stats_lock:
+        _run_stats.setdefault(run_id or current_run_id.get(), DedupStats()).add(stats)
+
+
+def get_dedup_stats(run_id: Optional[str] = None) -> Dict[str, Any]:
+    """Returns the sources seen, near duplicates removed and tokens saved over a run's prompts."""
+    with _run_stats_lock:
+        return _run_stats.get(run_id or current_run_id.get(), DedupStats()).to_dict()
+
+
+def release_dedup_stats(run_id: Optional[str] = None):
+    """Forgets the totals of a finished run."""
+    with _run_stats_lock:
+        _run_stats.pop(run_id or current_run_id.get(), None)
@@ -1,10 +1,34 @@
-from typing import Optional, List
+from typing import Dict, Optional, List, Tuple
 from exa_py import Exa
 import asyncio
+import logging
 import os
+import weakref
+from search.rate_limit import TokenBucket, parse_retry_after
+from search.urls import canonicalize_url
+from accounting import note_retry
 
 
-exa = Exa(api_key=f"{os.getenv('EXA_API_KEY')}")
+logger = logging.getLogger(__name__)
+
+EXA_API_KEY = f"{os.getenv('EXA_API_KEY')}"
+exa = Exa(api_key=EXA_API_KEY)
+
+# Per event loop and API key, the concurrency limit and rate limiter shared by every exa_search call,
+# so concurrent sections share one request rate and the backoff learned from 429s
+_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Tuple[asyncio.Semaphore, TokenBucket]]]" = weakref.WeakKeyDictionary()
+
+
+def get_exa_limiter(max_concurrency: int, requests_per_second: float) -> Tuple[asyncio.Semaphore, TokenBucket]:
+    """Returns the semaphore and rate limiter of the Exa API key on the running event loop.
+
+    They are created with the settings of the first call; later calls share them.
+    """
+    limiters = _limiters.setdefault(asyncio.get_running_loop(), {})
+    limiter = limiters.get(EXA_API_KEY)
+    if limiter is None:
+        limiter = limiters[EXA_API_KEY] = (asyncio.Semaphore(max(1, max_concurrency)), TokenBucket(requests_per_second))
+    return limiter
 
 def get_value(item:dict, key, default=None):
     if isinstance(item, dict):
@@ -35,9 +59,23 @@ def exa_search_fn(
     
     return exa.search_and_contents(query, **kwargs)
 
-async def process_query(query: str, subpages:Optional[int]=None):
-    loop = asyncio.get_event_loop()
-    response = await loop.run_in_executor(None, exa_search_fn)
+async def process_query(
+        query: str,
+        subpages:Optional[int]=None,
+        include_domains:Optional[List[str]]=None,
+        exclude_domains:Optional[List[str]]=None
+        ):
+    loop = asyncio.get_running_loop()
+    response = await loop.run_in_executor(
+        None,
+        lambda: exa_search_fn(
+            query,
+            num_results=5,
+            subpages=subpages,
+            include_domains=include_domains,
+            exclude_domains=exclude_domains
+        )
+    )
     formatted_results = []
     seen_urls = set()
     result_list = get_value(response, "results", [])
@@ -53,9 +91,10 @@ async def process_query(query: str, subpages:Optional[int]=None):
                 content = summary_content
         title = get_value(result, "title", "")
         url = get_value(result, "url", "")
-        if url in seen_urls:
+        canonical_url = canonicalize_url(url)
+        if canonical_url in seen_urls:
             continue
-        seen_urls.add(url)
+        seen_urls.add(canonical_url)
         
         result_entry = {
             "title":title, 
@@ -81,8 +120,9 @@ async def process_query(query: str, subpages:Optional[int]=None):
                         subpage_content = f"{subpage_summary}\n\n{subpage_content}"
                     else:
                         subpage_content = subpage_summary
-                if subpage_url not in seen_urls:
-                    seen_urls.add(subpage_url)
+                canonical_subpage_url = canonicalize_url(subpage_url)
+                if canonical_subpage_url not in seen_urls:
+                    seen_urls.add(canonical_subpage_url)
                     formatted_results.append(
                         {
                             "title": subpage_title, 
@@ -111,26 +151,62 @@ async def process_query(query: str, subpages:Optional[int]=None):
 
     
 
+def is_rate_limited(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or "429" in str(error)
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    return parse_retry_after(headers.get("Retry-After"))
+
+
+async def process_query_with_retries(query: str, rate_limiter: TokenBucket, max_retries: int, **kwargs):
+    """Runs one query through the shared rate limiter, retrying rate limited requests."""
+    attempt = 0
+    while True:
+        await rate_limiter.acquire()
+        try:
+            result = await process_query(query, **kwargs)
+            rate_limiter.success()
+            return result
+        except Exception as e:
+            if not is_rate_limited(e) or attempt >= max_retries:
+                raise
+            delay = rate_limiter.backoff(get_retry_after(e), attempt)
+            logger.info(f"Rate limit exceeded for '{query}'. Retrying in {delay:.1f}s...")
+            note_retry()
+            attempt += 1
+
+
 async def exa_search(
     search_queries, 
     include_domains:Optional[List[str]]=None,
     exclude_domains:Optional[List[str]]=None,
-    subpages:Optional[int]=None):
+    subpages:Optional[int]=None,
+    max_concurrency:int=4,
+    requests_per_second:float=4.0,
+    max_retries:int=3):
     """Search the web using the Exa API.
     
+    Queries run concurrently, at most `max_concurrency` at a time and no faster than
+    `requests_per_second`, limits shared by all concurrent calls on the event loop
+    (see `get_exa_limiter`). Rate limited queries back off (honoring Retry-After when
+    available) and are retried up to `max_retries` times.
+
     Args:
         search_queries (List[SearchQuery]): List of search queries to process
-        max_characters (int, optional): Maximum number of characters to retrieve for each result's raw content.
-                                       If None, the text parameter will be set to True instead of an object.
-        num_results (int): Number of search results per query. Defaults to 5.
         include_domains (List[str], optional): List of domains to include in search results. 
             When specified, only results from these domains will be returned.
         exclude_domains (List[str], optional): List of domains to exclude from search results.
             Cannot be used together with include_domains.
         subpages (int, optional): Number of subpages to retrieve per result. If None, subpages are not retrieved.
+        max_concurrency (int): Maximum number of queries in flight at once. 1 runs queries serially.
+        requests_per_second (float): Sustained request rate towards the Exa API.
+        max_retries (int): Retries for a rate limited query before it is reported as an error.
         
     Returns:
-        List[dict]: List of search responses from Exa API, one per query. Each response has format:
+        List[dict]: List of search responses from Exa API, one per query and in query order. Each response has format:
             {
                 'query': str,                    # The original search query
                 'follow_up_questions': None,      
@@ -151,27 +227,26 @@ async def exa_search(
     if include_domains and exclude_domains: 
         raise ValueError("Cannot use both include_domains and exclude_domains")
     
-    search_docs = []
-    for i, query in enumerate(search_queries):
-        try:
-            if i > 0:
-                await asyncio.sleep(0.25)
-            result = await process_query(query, subpages)
-            search_docs.append(result)
-        except Exception as e:
-            print(f"Error processing query '{query}': {str(e)}")
-            search_docs.append({
-                "query": query,
-                "follow_up_questions": None,
-                "answer": None,
-                "images": [],
-                "results": [],
-                "error": str(e)
-            })
-
-            if "429" in str(e):
-                print("Rate limit exceeded. Adding additional delay...")
-                await asyncio.sleep(1.0)
-    
-    return search_docs
-    
\ No newline at end of file
+    semaphore, rate_limiter = get_exa_limiter(max_concurrency, requests_per_second)
+
+    async def run(query):
+        async with semaphore:
+            try:
+                return await process_query_with_retries(
+                    query, rate_limiter, max_retries,
+                    subpages=subpages,
+                    include_domains=include_domains,
+                    exclude_domains=exclude_domains
+                )
+            except Exception as e:
+                logger.error(f"Error processing query '{query}': {str(e)}")
+                return {
+                    "query": query,
+                    "follow_up_questions": None,
+                    "answer": None,
+                    "images": [],
+                    "results": [],
+                    "error": str(e)
+                }
+
+    return list(await asyncio.gather(*(run(query) for query in search_queries)))
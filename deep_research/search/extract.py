@@ -0,0 +1,195 @@
+import os
+import re
+import codecs
+import asyncio
+import logging
+import weakref
+import concurrent.futures
+from html.parser import HTMLParser
+
+logger = logging.getLogger(__name__)
+
+# Elements whose content is never part of the readable page text
+BOILERPLATE_TAGS = {
+    "script", "style", "noscript", "template", "svg", "iframe", "canvas",
+    "nav", "header", "footer", "aside", "form", "button", "select",
+}
+
+# Elements that start a new line in the extracted text
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "br", "li", "ul", "ol", "table", "tr",
+    "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "dd", "dt", "hr",
+}
+
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+
+
+class TextExtractor(HTMLParser):
+    """Incremental HTML to text extractor that drops boilerplate elements.
+
+    Feed it decoded HTML chunks as they arrive; `done` becomes True once `max_chars`
+    characters of text were collected, at which point the caller can stop reading.
+    """
+
+    def __init__(self, max_chars: int | None = None):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.done = False
+        self._parts = []
+        self._length = 0
+        self._skip_stack = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BOILERPLATE_TAGS:
+            self._skip_stack.append(tag)
+        elif tag in BLOCK_TAGS and not self._skip_stack:
+            self._parts.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS and not self._skip_stack:
+            self._parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self._skip_stack:
+            # Close the element and anything left unclosed inside it
+            while self._skip_stack and self._skip_stack.pop() != tag:
+                pass
+        elif tag in BLOCK_TAGS and not self._skip_stack:
+            self._parts.append("\n")
+
+    def handle_data(self, data):
+        if self._skip_stack or self.done:
+            return
+        self._parts.append(data)
+        self._length += len(data)
+        if self.max_chars is not None and self._length >= self.max_chars:
+            self.done = True
+
+    def feed(self, data):
+        if not self.done:
+            super().feed(data)
+
+    def get_text(self) -> str:
+        text = _SPACES.sub(" ", "".join(self._parts))
+        text = _BLANK_LINES.sub("\n\n", text)
+        text = "\n".join(line.strip() for line in text.split("\n")).strip()
+        if self.max_chars is not None:
+            text = text[:self.max_chars]
+        return text
+
+
+def extract_text(html: str, max_chars: int | None = None) -> str:
+    """Extracts the readable text of an HTML document, capped at `max_chars` characters."""
+    extractor = TextExtractor(max_chars)
+    extractor.feed(html)
+    extractor.close()
+    return extractor.get_text()
+
+
+EXTRACT_SLICE_SIZE = 64 * 1024
+
+
+def extract_text_from_bytes(raw: bytes, encoding: str | None = None, max_chars: int | None = None) -> str:
+    """Decodes and extracts raw HTML bytes in slices, stopping as soon as `max_chars` is reached."""
+    try:
+        decoder = codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    extractor = TextExtractor(max_chars)
+    for start in range(0, len(raw), EXTRACT_SLICE_SIZE):
+        extractor.feed(decoder.decode(raw[start:start + EXTRACT_SLICE_SIZE]))
+        if extractor.done:
+            break
+    extractor.feed(decoder.decode(b"", final=True))
+    extractor.close()
+    return extractor.get_text()
+
+# Settings of the process wide extraction pool
+EXTRACTION_POOL_SETTINGS = {
+    "kind": "process",               # "process", "thread" or "inline"
+    "max_workers": os.cpu_count() or 2,
+    "max_pending": None,             # documents queued or parsing at once, defaults to 2 * max_workers
+    "inline_threshold": 32 * 1024,   # documents up to this many bytes are parsed on the event loop
+}
+
+
+class ExtractionPool:
+    """Runs HTML text extraction off the event loop.
+
+    Documents larger than `inline_threshold` bytes are parsed in a process (or thread)
+    pool so parsing scales across cores and does not stall other coroutines. At most
+    `max_pending` documents are submitted at once; further callers wait, which keeps
+    the memory held by queued page bodies bounded.
+    """
+
+    def __init__(self, kind: str = "process", max_workers: int | None = None,
+                 max_pending: int | None = None, inline_threshold: int = 32 * 1024):
+        if kind not in ("process", "thread", "inline"):
+            raise ValueError(f"Unsupported extraction pool kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.max_pending = max_pending or 2 * self.max_workers
+        self.inline_threshold = inline_threshold
+        self._executor = None
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="html-extract"
+                )
+        return self._executor
+
+    async def extract(self, raw: bytes, encoding: str | None = None, max_chars: int | None = None) -> str:
+        if self.kind == "inline" or len(raw) <= self.inline_threshold:
+            return extract_text_from_bytes(raw, encoding, max_chars)
+
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_pending)
+        async with semaphore:
+            try:
+                return await loop.run_in_executor(
+                    self._get_executor(), extract_text_from_bytes, raw, encoding, max_chars
+                )
+            except concurrent.futures.BrokenExecutor:
+                logger.error("Extraction pool is broken, parsing inline")
+                self._executor = None
+                return extract_text_from_bytes(raw, encoding, max_chars)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_extraction_pool: ExtractionPool | None = None
+
+
+def configure_extraction_pool(**settings):
+    """Overrides the extraction pool settings, replacing the current pool.
+
+    Args:
+        **settings: Any of the keys of EXTRACTION_POOL_SETTINGS
+    """
+    global _extraction_pool
+    unknown = set(settings) - set(EXTRACTION_POOL_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown extraction pool settings: {sorted(unknown)}")
+    EXTRACTION_POOL_SETTINGS.update(settings)
+    if _extraction_pool is not None:
+        _extraction_pool.shutdown()
+        _extraction_pool = None
+
+
+def get_extraction_pool() -> ExtractionPool:
+    """Returns the process-wide extraction pool, creating it on first use."""
+    global _extraction_pool
+    if _extraction_pool is None:
+        _extraction_pool = ExtractionPool(**EXTRACTION_POOL_SETTINGS)
+    return _extraction_pool
@@ -0,0 +1,172 @@
+import heapq
+import asyncio
+import logging
+import weakref
+import itertools
+import contextvars
+from typing import Awaitable, Callable, Dict, Optional
+from urllib.parse import urlsplit
+from search.rate_limit import TokenBucket, RateLimitError
+from accounting import note_retry
+
+logger = logging.getLogger(__name__)
+
+# Settings of the per event loop fetch scheduler
+FETCH_SCHEDULER_SETTINGS = {
+    "max_concurrency": 32,          # page fetches in flight across all hosts
+    "per_host_concurrency": 2,      # page fetches in flight to a single host
+    "per_host_rate": 2.0,           # sustained requests per second to a single host
+    "max_retries": 2,               # retries of a rate limited fetch
+}
+
+# Lower values are served first. Set per section by the caller, see search_web.
+fetch_priority: contextvars.ContextVar[int] = contextvars.ContextVar("fetch_priority", default=0)
+
+
+class _HostGate:
+    """Concurrency slots and a rate limiter for one host, handed out in priority order."""
+
+    def __init__(self, concurrency: int, rate: float):
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.active = 0
+        self._waiters = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority: int):
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._counter), waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was already handed to us, pass it on
+                    self.release()
+                raise
+        try:
+            await self.bucket.acquire()
+        except asyncio.CancelledError:
+            self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                # Hand the slot over directly so `active` stays unchanged
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class FetchScheduler:
+    """Coordinates page fetches across all queries and sections on an event loop.
+
+    - at most `max_concurrency` fetches run at once, and at most `per_host_concurrency`
+      and `per_host_rate` requests per second go to any single host
+    - waiting fetches for a host are started in `fetch_priority` order, then FIFO
+    - concurrent fetches of the same URL share a single request; if the caller that
+      started it is cancelled, a waiting caller issues the request instead
+    - a RateLimitError from the fetch slows the host down and the fetch is retried
+    """
+
+    def __init__(self, max_concurrency: int = 32, per_host_concurrency: int = 2,
+                 per_host_rate: float = 2.0, max_retries: int = 2):
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_rate = per_host_rate
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._hosts: Dict[str, _HostGate] = {}
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.stats = {"fetches": 0, "coalesced": 0, "rate_limited": 0}
+
+    def _gate(self, host: str) -> _HostGate:
+        gate = self._hosts.get(host)
+        if gate is None:
+            gate = self._hosts[host] = _HostGate(self.per_host_concurrency, self.per_host_rate)
+        return gate
+
+    async def fetch(self, url: str, fetch_fn: Callable[[], Awaitable], priority: Optional[int] = None):
+        """Runs `fetch_fn` for `url` under the scheduler's limits and returns its result.
+
+        Args:
+            url: The URL being fetched, used for per-host limits and coalescing
+            fetch_fn: Coroutine function performing the request
+            priority: Overrides the `fetch_priority` of the current context
+        """
+        in_flight = self._in_flight.get(url)
+        if in_flight is not None:
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if not in_flight.cancelled():
+                    raise
+                # The leading fetch was cancelled (e.g. a discarded prefetch), the first waiter takes over
+                return await self.fetch(url, fetch_fn, priority)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[url] = future
+        try:
+            result = await self._fetch(url, fetch_fn, fetch_priority.get() if priority is None else priority)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[url]
+
+    async def _fetch(self, url: str, fetch_fn: Callable[[], Awaitable], priority: int):
+        gate = self._gate(urlsplit(url).netloc.lower())
+        attempt = 0
+        while True:
+            await gate.acquire(priority)
+            try:
+                async with self._semaphore:
+                    self.stats["fetches"] += 1
+                    result = await fetch_fn()
+                gate.bucket.success()
+                return result
+            except RateLimitError as e:
+                self.stats["rate_limited"] += 1
+                if attempt >= self.max_retries:
+                    raise
+                delay = gate.bucket.backoff(e.retry_after, attempt)
+                logger.info(f"Rate limited by {urlsplit(url).netloc}, backing off {delay:.1f}s")
+                note_retry()
+                attempt += 1
+            finally:
+                gate.release()
+
+
+_schedulers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, FetchScheduler]" = weakref.WeakKeyDictionary()
+
+
+def configure_fetch_scheduler(**settings):
+    """Overrides the fetch scheduler settings. Only affects schedulers created afterwards.
+
+    Args:
+        **settings: Any of the keys of FETCH_SCHEDULER_SETTINGS
+    """
+    unknown = set(settings) - set(FETCH_SCHEDULER_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown fetch scheduler settings: {sorted(unknown)}")
+    FETCH_SCHEDULER_SETTINGS.update(settings)
+
+
+def get_fetch_scheduler() -> FetchScheduler:
+    """Returns the fetch scheduler of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    scheduler = _schedulers.get(loop)
+    if scheduler is None:
+        scheduler = _schedulers[loop] = FetchScheduler(**FETCH_SCHEDULER_SETTINGS)
+    return scheduler
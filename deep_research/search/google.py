@@ -5,10 +5,17 @@ import aiohttp
 import asyncio
 import requests
 import random
+import weakref
 import concurrent.futures
 from asyncio import Semaphore
 from urllib.parse import unquote
 from bs4 import BeautifulSoup
+from search.http_session import get_http_session
+from search.extract import get_extraction_pool
+from search.fetch_scheduler import get_fetch_scheduler
+from search.rate_limit import RateLimitError, parse_retry_after
+from search.urls import canonicalize_url
+from search.corpus import get_run_corpus
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +29,7 @@ def get_useragent():
 
 async def search_single_query_with_api(query: str, api_key: str, cx: str, max_results: int):
     results = []
+    session = get_http_session()
     try:
         for start_idx in range(1, max_results+1, 10):
             num = min(10, max_results - (start_idx -1))
@@ -34,94 +42,159 @@ async def search_single_query_with_api(query: str, api_key: str, cx: str, max_re
             }
             logger.info(f"Requesting {num} results for '{query}' with google search api")
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get("https://www.googleapis.com/customsearch/v1", params=params) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Error fetching results for '{query}': {error_text}")
-                        break
-                    
-                    data = await response.json()
-                    for item in data.get("items", []):
-                        result = {
-                            "title": item.get("title", ""),
-                            "url": item.get("link", ""),
-                            "content": item.get("snippet", ""),
-                            "score": None,
-                            "raw_content": item.get("snippet", "")
-                        }
-                        results.append(result)
+            async with session.get("https://www.googleapis.com/customsearch/v1", params=params) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"Error fetching results for '{query}': {error_text}")
+                    break
                 
-                await asyncio.sleep(0.2) #respect api rate limits with a small delay
+                data = await response.json()
+                for item in data.get("items", []):
+                    result = {
+                        "title": item.get("title", ""),
+                        "url": item.get("link", ""),
+                        "content": item.get("snippet", ""),
+                        "score": None,
+                        "raw_content": item.get("snippet", "")
+                    }
+                    results.append(result)
 
             # If we didn't get a full page of results, no need to request more
             if not data.get("items") or len(data.get("items", [])) < num:
                 break
+
+            await asyncio.sleep(0.2) #respect api rate limits with a small delay
     except Exception as e:
         logger.error(f"Error fetching results using google search api for '{query}': {e}")
 
     return results
 
 
+GOOGLE_SEARCH_URL = "https://www.google.com/search"
+GOOGLE_COOKIES = {
+    "CONSENT": "PENDING+987",
+    "SOCS": "CAESHAgBEhIaAB"
+}
+# Concurrent scraping requests to google across all searches on an event loop
+SCRAPE_CONCURRENCY = 2
+SCRAPE_PAGE_DELAY = 1.0
+
+# Budgets for reading a fetched page; nothing past these is ever used in a prompt
+MAX_CONTENT_BYTES = 2_000_000
+MAX_CONTENT_CHARS = 50_000
+CONTENT_CHUNK_SIZE = 64 * 1024
+# Bytes of HTML read per character of the text budget before the first extraction
+MARKUP_BYTES_PER_CHAR = 4
+
+_scrape_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Semaphore]" = weakref.WeakKeyDictionary()
+_scrape_executor: concurrent.futures.ThreadPoolExecutor | None = None
+
+
+def _scrape_params(query: str, max_results: int, start: int) -> dict:
+    return {
+        "q": query,
+        "num": max_results + 2,
+        "hl": "en",
+        "start": start,
+        "safe": "active",
+    }
+
+
+def parse_scraped_results(html: str, fetched_links: set, search_results: list, max_results: int) -> int:
+    """Parses one google results page, appending results whose link was not seen yet.
+
+    Returns:
+        int: The number of new results added
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    result_block = soup.find_all("div", class_="ezo2md")
+    new_results = 0
+    for result in result_block:
+        link_tag = result.find("a", href=True)
+        title_tag = result.find("span", class_="CVA68e") if link_tag else None
+        description_tag = result.find("span",class_="FrIlee")
+        if link_tag and title_tag and description_tag:
+            link = unquote(link_tag["href"].split("&")[0].replace("/url?q=", ""))
+            canonical_link = canonicalize_url(link)
+            if canonical_link in fetched_links:
+                continue
+            fetched_links.add(canonical_link)
+            title = title_tag.text
+            description = description_tag.text
+            search_results.append({
+                "title": title,
+                "url": link,
+                "content": description,
+                "score": None,
+                "raw_content": description
+            })
+            new_results += 1
+
+            if len(search_results) >= max_results:
+                break
+    return new_results
+
+
+async def search_single_query_with_async_scraping(query: str, max_results: int):
+    """Scrapes google results pages on the event loop using the pooled http session."""
+    loop = asyncio.get_running_loop()
+    scrape_semaphore = _scrape_semaphores.get(loop)
+    if scrape_semaphore is None:
+        scrape_semaphore = _scrape_semaphores[loop] = Semaphore(SCRAPE_CONCURRENCY)
+
+    session = get_http_session()
+    start = 0
+    fetched_links = set()
+    search_results = []
+    try:
+        while len(search_results) < max_results:
+            async with scrape_semaphore:
+                async with session.get(
+                    GOOGLE_SEARCH_URL,
+                    headers={
+                        "User-Agent": get_useragent(),
+                        "Accept": "*/*",
+                    },
+                    params=_scrape_params(query, max_results, start),
+                    cookies=GOOGLE_COOKIES
+                ) as resp:
+                    resp.raise_for_status()
+                    html = await resp.text(errors="replace")
+
+            if parse_scraped_results(html, fetched_links, search_results, max_results) == 0:
+                break
+            start += 10
+            if len(search_results) < max_results:
+                await asyncio.sleep(SCRAPE_PAGE_DELAY) #delay between pages
+
+        return search_results
+    except Exception as e:
+        logger.error(f"Error fetching results for '{query}': {e}")
+        return search_results
+
+
 def search_single_query_with_scraping(query: str, max_results: int):
+    """Blocking scraper, only used when google_search is called with use_thread_pool=True."""
     try:
-        lang = "en"
-        safe = "active"
         start = 0
-        fetched_results = 0
         fetched_links = set()
         search_results = []
 
-        while fetched_results < max_results:
+        while len(search_results) < max_results:
             resp = requests.get(
-                url="https://www.google.com/search",
+                url=GOOGLE_SEARCH_URL,
                 headers={
                     "User-Agent": get_useragent(),
                     "Accept": "*/*",
                 },
-                params={
-                    "q": query,
-                    "num": max_results + 2,
-                    "hl": lang,
-                    "start": start,
-                    "safe": safe,
-                },
-                cookies = {
-                    "CONSENT": "PENDING+987",
-                    "SOCS": "CAESHAgBEhIaAB"
-                }
+                params=_scrape_params(query, max_results, start),
+                cookies=GOOGLE_COOKIES
             )
             resp.raise_for_status()
-            soup = BeautifulSoup(resp.text, "html.parser")
-            result_block = soup.find_all("div", _class="ezo2md")
-            new_results = 0
-            for result in result_block:
-                link_tag = result.find("a", href=True)
-                title_tag = result.find("span", class_="CVA68e") if link_tag else None
-                description_tag = result.find("span",class_="FrIlee")
-                if link_tag and title_tag and description_tag:
-                   link = unquote(link_tag["href"].split("&")[0].replace("/url?q=", ""))
-                   if link in fetched_links:
-                       continue
-                   fetched_links.add(link)
-                   title = title_tag.text
-                   description = description_tag.text
-                   search_results.append({
-                       "title": title,
-                       "url": link,
-                       "content": description,
-                       "score": None,
-                       "raw_content": description
-                   })
-                   new_results += 1
-                   fetched_results += 1
-
-                   if fetched_results >= max_results:
-                       break
-            if new_results == 0:
+            if parse_scraped_results(resp.text, fetched_links, search_results, max_results) == 0:
                 break
             start += 10
-            time.sleep(1) #delay between pages
+            time.sleep(SCRAPE_PAGE_DELAY) #delay between pages
         
         return search_results
     except Exception as e:
@@ -129,44 +202,117 @@ def search_single_query_with_scraping(query: str, max_results: int):
         return []
     
 
-async def fetch_full_content(result, content_semaphore, session):
-    async with content_semaphore:
-        url = result["url"]
-        headers = {
-            "User-Agent": get_useragent(),
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.",
-        }
+def get_scrape_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Returns the thread pool used by the blocking scraping fallback, created once per process."""
+    global _scrape_executor
+    if _scrape_executor is None:
+        _scrape_executor = concurrent.futures.ThreadPoolExecutor(max_workers=5, thread_name_prefix="google-scrape")
+    return _scrape_executor
+
+
+async def read_text_capped(response, max_bytes: int, max_chars: int) -> str:
+    """Streams the response body into the extraction pool until `max_chars` of text are extracted.
+
+    The body is read in windows that start at `MARKUP_BYTES_PER_CHAR` bytes per character
+    of the budget and double up to `max_bytes`. After each window the text read so far is
+    extracted, and reading stops as soon as it fills the budget.
+    """
+    pool = get_extraction_pool()
+    chunks = []
+    read_bytes = 0
+    window = min(max_bytes, max_chars * MARKUP_BYTES_PER_CHAR)
+    while True:
+        exhausted = False
+        while read_bytes < window:
+            chunk = await response.content.read(min(CONTENT_CHUNK_SIZE, window - read_bytes))
+            if not chunk:
+                exhausted = True
+                break
+            chunks.append(chunk)
+            read_bytes += len(chunk)
+        text = await pool.extract(b"".join(chunks), response.charset, max_chars)
+        if exhausted or len(text) >= max_chars or read_bytes >= max_bytes:
+            return text
+        window = min(max_bytes, window * 2)
+
+
+async def download_page_text(
+        url: str, session,
+        max_content_bytes: int = MAX_CONTENT_BYTES,
+        max_content_chars: int = MAX_CONTENT_CHARS
+        ) -> str | None:
+    """Downloads one page and returns its text, or None if the page could not be retrieved.
+
+    Raises:
+        RateLimitError: If the host answered with 429 or 503
+    """
+    headers = {
+        "User-Agent": get_useragent(),
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.",
+    }
+    async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=10)) as response:
+        if response.status in (429, 503):
+            raise RateLimitError(
+                f"{response.status} from {url}",
+                parse_retry_after(response.headers.get("Retry-After"))
+            )
+        if response.status != 200:
+            return None
+        content_type = response.headers.get("Content-Type", "").lower()
+        if "application/pdf" in content_type or "application/octet-stream" in content_type:
+            return f"[Binary content: {content_type}. Content extraction not supported for this type of file]"
         try:
-            await asyncio.sleep(0.2 + random.random()*0.6)
-            async with session.get(url, headers=headers, timeout=10) as response:
-                if response.status == 200:
-                    content_type = response.headers.get("Content-Type", "").lower()
-                    if "application/pdf" in content_type or "application/octet-stream" in content_type:
-                        result["raw_content"] = f"[Binary content: {content_type}. Content extraction not supported for this type of file]"
-                    else:
-                        try:
-                            html = await response.text(errors="replace")
-                            soup = BeautifulSoup(html, "html.parser")
-                            result["raw_content"] = soup.get_text()
-                        except UnicodeDecodeError as ude:
-                            result["raw_content"] = f"[Could not decode content: {str(ude)}]"
-        except Exception as e:
-            logger.error(f"Warning: Failed to fetch content for {url}: {str(e)}")
-            result["raw_content"] = f"[Error fetching content: {str(e)}]"
-        
+            return await read_text_capped(response, max_content_bytes, max_content_chars)
+        except UnicodeDecodeError as ude:
+            return f"[Could not decode content: {str(ude)}]"
+
+
+async def fetch_full_content(
+        result, session,
+        max_content_bytes: int = MAX_CONTENT_BYTES,
+        max_content_chars: int = MAX_CONTENT_CHARS
+        ):
+    """Replaces the result's raw_content with the page text.
+
+    Pages already fetched in this run are taken from the run's corpus; others are
+    fetched through the shared fetch scheduler, coalesced on their canonical URL.
+    """
+    url = result["url"]
+    canonical_url = canonicalize_url(url)
+    corpus = get_run_corpus()
+    cached_content = corpus.get_page(canonical_url)
+    if cached_content is not None:
+        result["raw_content"] = cached_content
         return result
+    try:
+        content = await get_fetch_scheduler().fetch(
+            canonical_url,
+            lambda: download_page_text(url, session, max_content_bytes, max_content_chars)
+        )
+        if content is not None:
+            result["raw_content"] = content
+            corpus.set_page(canonical_url, content)
+    except Exception as e:
+        logger.error(f"Warning: Failed to fetch content for {url}: {str(e)}")
+        result["raw_content"] = f"[Error fetching content: {str(e)}]"
+
+    return result
 
     
 async def search_single_query(
         semaphore: Semaphore, 
-        executor: concurrent.futures.ThreadPoolExecutor, 
+        executor: concurrent.futures.ThreadPoolExecutor | None, 
         query: str, max_results: int, include_raw_content: bool,
-        use_api: bool, api_key: str, cx: str
+        use_api: bool, api_key: str, cx: str,
+        max_content_bytes: int = MAX_CONTENT_BYTES,
+        max_content_chars: int = MAX_CONTENT_CHARS
         ):
     try:
         async with semaphore:
             if use_api:
                 search_results = await search_single_query_with_api(query, api_key, cx, max_results)
+            elif executor is None:
+                search_results = await search_single_query_with_async_scraping(query, max_results)
             else:
                 loop = asyncio.get_running_loop()
                 search_results = await loop.run_in_executor(
@@ -176,16 +322,15 @@ async def search_single_query(
             
             results = search_results
             if include_raw_content and results:
-                content_semaphore = asyncio.Semaphore(3)
-                async with aiohttp.ClientSession() as session:
-                    fetch_tasks = []
-                    
-                    for result in results:
-                        fetch_tasks.append(fetch_full_content(result))
-                    
-                    updated_results = await asyncio.gather(*fetch_tasks)
-                    results = updated_results
-                    logger.info(f"Fetched full content for {len(results)} results")
+                session = get_http_session()
+                fetch_tasks = []
+
+                for result in results:
+                    fetch_tasks.append(fetch_full_content(result, session, max_content_bytes, max_content_chars))
+
+                updated_results = await asyncio.gather(*fetch_tasks)
+                results = updated_results
+                logger.info(f"Fetched full content for {len(results)} results")
             
             return {
                 "query": query,
@@ -208,6 +353,9 @@ async def google_search(
         search_queries: str | list[str],
         max_results: int = 5,
         include_raw_content: bool = True,
+        use_thread_pool: bool = False,
+        max_content_bytes: int = MAX_CONTENT_BYTES,
+        max_content_chars: int = MAX_CONTENT_CHARS,
 ):
     """
     Performs concurrent web searches using Google.
@@ -217,6 +365,10 @@ async def google_search(
         search_queries (List[str]): List of search queries to process
         max_results (int): Maximum number of results to return per query
         include_raw_content (bool): Whether to fetch full page content
+        use_thread_pool (bool): Scrape with blocking requests in a thread pool instead of asyncio.
+            Only a fallback for environments where the async scraper is blocked.
+        max_content_bytes (int): Stop downloading a page after this many bytes
+        max_content_chars (int): Stop extracting page text after this many characters
 
     Returns:
         List[dict]: List of search responses from Google, one per query
@@ -229,11 +381,14 @@ async def google_search(
         search_queries = [search_queries]
     
     semaphore = asyncio.Semaphore(5 if use_api else 2)
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=5) if not use_api else None
+    executor = get_scrape_executor() if use_thread_pool and not use_api else None
 
     try:
         search_tasks = [
-            search_single_query(semaphore, executor, query, max_results, include_raw_content, use_api, api_key, cx) 
+            search_single_query(
+                semaphore, executor, query, max_results, include_raw_content, use_api, api_key, cx,
+                max_content_bytes, max_content_chars
+            )
             for query in search_queries]
         
         search_results = await asyncio.gather(*search_tasks)
@@ -241,7 +396,4 @@ async def google_search(
     except Exception as e:
         logger.error(f"Error fetching results: {e}")
         return []
-    finally:
-        if executor:
-            executor.shutdown(wait=False)
     
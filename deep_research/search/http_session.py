@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import weakref
+import aiohttp
+from typing import Optional, Set
+from utils import current_run_id
+
+logger = logging.getLogger(__name__)
+
+# Connection pool settings shared by every search backend and page fetch in the process
+HTTP_SESSION_SETTINGS = {
+    "limit": 100,              # total open connections
+    "limit_per_host": 8,       # open connections to any single host
+    "ttl_dns_cache": 300,      # seconds to cache DNS lookups
+    "keepalive_timeout": 30,   # seconds to keep idle connections open
+    "total_timeout": 30,       # default per request timeout in seconds
+}
+
+# aiohttp sessions are bound to the event loop they were created on, so keep one per loop
+_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+# The runs that used each loop's session, so it is closed once the last of them completes
+_session_runs: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Set[str]]" = weakref.WeakKeyDictionary()
+
+
+def configure_http_session(**settings):
+    """Overrides the connection pool settings. Only affects sessions created afterwards.
+
+    Args:
+        **settings: Any of the keys of HTTP_SESSION_SETTINGS
+    """
+    unknown = set(settings) - set(HTTP_SESSION_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown http session settings: {sorted(unknown)}")
+    HTTP_SESSION_SETTINGS.update(settings)
+
+
+def hold_http_session(run_id: Optional[str] = None):
+    """Registers a run as a user of the running event loop's pooled session.
+
+    Runs register when they start, before their first request, so another run
+    finishing in the meantime does not close the session under them.
+    """
+    _session_runs.setdefault(asyncio.get_running_loop(), set()).add(run_id or current_run_id.get())
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Returns the pooled keep-alive session for the running event loop, creating it on first use.
+
+    Callers must not close the returned session; runs release it with `release_http_session`,
+    and `close_http_session` closes it on shutdown.
+    """
+    loop = asyncio.get_running_loop()
+    hold_http_session()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_SESSION_SETTINGS["limit"],
+            limit_per_host=HTTP_SESSION_SETTINGS["limit_per_host"],
+            ttl_dns_cache=HTTP_SESSION_SETTINGS["ttl_dns_cache"],
+            keepalive_timeout=HTTP_SESSION_SETTINGS["keepalive_timeout"],
+        )
+        session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_SESSION_SETTINGS["total_timeout"])
+        )
+        _sessions[loop] = session
+        logger.info("Opened pooled http session")
+    return session
+
+
+async def close_http_session():
+    """Closes the pooled session of the running event loop, if any."""
+    loop = asyncio.get_running_loop()
+    _session_runs.pop(loop, None)
+    session = _sessions.pop(loop, None)
+    if session is not None and not session.closed:
+        await session.close()
+        logger.info("Closed pooled http session")
+
+
+async def release_http_session(run_id: Optional[str] = None):
+    """Releases the pooled session of the running event loop for a finished run.
+
+    The session is closed once no other run on the loop is using it.
+    """
+    loop = asyncio.get_running_loop()
+    runs = _session_runs.get(loop, set())
+    runs.discard(run_id or current_run_id.get())
+    if not runs:
+        await close_http_session()
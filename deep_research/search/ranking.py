@@ -0,0 +1,117 @@
+import re
+import math
+from collections import Counter
+from typing import List, Optional, Tuple
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_PARAGRAPH = re.compile(r"\n\s*\n")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have how in is it its of on or that the
+their this to was were what when where which who why will with
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    return [word for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+def split_passages(text: str, max_chars: int = 600) -> List[str]:
+    """Splits a document into passages of at most roughly `max_chars` characters.
+
+    Paragraphs are kept together and merged while they fit; paragraphs longer than
+    `max_chars` are split on sentence boundaries (and hard-split as a last resort).
+    """
+    pieces = []
+    for paragraph in _PARAGRAPH.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in _SENTENCE.split(paragraph):
+            while len(sentence) > max_chars:
+                pieces.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            if sentence:
+                pieces.append(sentence)
+
+    passages = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 1 > max_chars:
+            passages.append(current)
+            current = piece
+        else:
+            current = f"{current}\n{piece}" if current else piece
+    if current:
+        passages.append(current)
+    return passages
+
+
+class BM25:
+    """Okapi BM25 over a fixed list of passages."""
+
+    def __init__(self, passages: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [Counter(tokenize(passage)) for passage in passages]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        doc_freqs = Counter()
+        for tf in self.term_freqs:
+            doc_freqs.update(tf.keys())
+        n = len(passages)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items()}
+
+    def scores(self, query: str) -> List[float]:
+        terms = [term for term in set(tokenize(query)) if term in self.idf]
+        scores = []
+        for tf, length in zip(self.term_freqs, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / self.avg_length) if self.avg_length else self.k1
+            score = 0.0
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    score += self.idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            scores.append(score)
+        return scores
+
+
+def rank_passages(documents: List[str], query: str, passage_chars: int = 600) -> List[List[Tuple[int, str, float]]]:
+    """Splits every document into passages and scores them against the query with one shared BM25 index.
+
+    Returns:
+        For each document, its passages as (position, text, score) in document order
+    """
+    split = [split_passages(document, passage_chars) for document in documents]
+    flat = [passage for passages in split for passage in passages]
+    scores = BM25(flat).scores(query) if flat else []
+    ranked, offset = [], 0
+    for passages in split:
+        ranked.append([(i, passage, scores[offset + i]) for i, passage in enumerate(passages)])
+        offset += len(passages)
+    return ranked
+
+
+def select_passages(passages: List[Tuple[int, str, float]], max_tokens: int, count_tokens,
+                    max_passages: Optional[int] = None) -> str:
+    """Keeps the best scoring passages that fit in `max_tokens`, joined back in document order.
+
+    Passages that share no term with the query are only used when no passage does.
+    """
+    if any(score > 0 for _, _, score in passages):
+        passages = [p for p in passages if p[2] > 0]
+    chosen, used = [], 0
+    for position, passage, score in sorted(passages, key=lambda p: (-p[2], p[0])):
+        if max_passages is not None and len(chosen) >= max_passages:
+            break
+        tokens = count_tokens(passage)
+        if used + tokens > max_tokens:
+            continue
+        chosen.append((position, passage))
+        used += tokens
+    chosen.sort()
+    return "\n...\n".join(passage for _, passage in chosen)
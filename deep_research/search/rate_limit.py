@@ -0,0 +1,79 @@
+import time
+import random
+import asyncio
+from typing import Optional
+
+
+class TokenBucket:
+    """Async token bucket rate limiter with AIMD adaptation.
+
+    `acquire` waits until a token is available. On a rate limit response callers
+    call `backoff`, which halves the refill rate and pauses the bucket (honoring
+    Retry-After when known); every success nudges the rate back towards its ceiling.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, min_rate: float = 0.1):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def backoff(self, retry_after: Optional[float] = None, attempt: int = 0) -> float:
+        """Slows the bucket down after a rate limit response.
+
+        Args:
+            retry_after: Seconds requested by the server, if it sent Retry-After
+            attempt: Number of rate limited attempts so far for the request, used for exponential backoff
+
+        Returns:
+            float: The number of seconds the bucket is paused for
+        """
+        self.rate = max(self.min_rate, self.rate / 2)
+        if retry_after is None:
+            retry_after = min(30.0, (2 ** attempt) * (0.5 + random.random()))
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        self._tokens = 0.0
+        return retry_after
+
+    def success(self):
+        """Additively restores the rate after a successful request."""
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """Parses a Retry-After header value given in seconds. HTTP dates are not supported."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitError(Exception):
+    """Raised by a request that was answered with a rate limit status."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
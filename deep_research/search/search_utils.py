@@ -1,7 +1,33 @@
-def deduplicate_and_format_sources(search_response, max_tokens_per_source, include_raw_content=True):
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from search.cache import SearchCache, make_cache_key
+from search.singleflight import get_search_flight
+from search.context import Tokenizer, pack_sources
+from search.dedup import remove_near_duplicates, record_dedup_stats
+from accounting import add_search_usage
+from search.urls import canonicalize_url
+from search.exa_search import exa_search
+from search.google import google_search
+
+logger = logging.getLogger(__name__)
+
+def deduplicate_and_format_sources(
+        search_response,
+        max_tokens_per_source,
+        include_raw_content=True,
+        max_total_tokens=None,
+        tokenizer: Optional[Tokenizer] = None,
+        relevance_query: Optional[str] = None,
+        max_passages_per_source: Optional[int] = None,
+        near_duplicate_distance: Optional[int] = 3
+        ):
     """
     Takes a list of search responses and formats them into a readable string.
-    Limits the raw_content to approximately max_tokens_per_source tokens.
+    Limits the raw_content to max_tokens_per_source tokens per source and the whole
+    string to max_total_tokens. With a relevance_query only the raw_content passages most
+    relevant to it are kept, see `search.context.pack_sources`. Sources with the same
+    URL or near-duplicate content (see `search.dedup`) are only included once.
  
     Args:
         search_responses: List of search response dicts, each containing:
@@ -14,6 +40,11 @@ def deduplicate_and_format_sources(search_response, max_tokens_per_source, inclu
                 - raw_content: str|None
         max_tokens_per_source: int
         include_raw_content: bool
+        max_total_tokens: int|None
+        tokenizer: Tokenizer|None
+        relevance_query: str|None
+        max_passages_per_source: int|None
+        near_duplicate_distance: int|None, None disables near-duplicate detection
             
     Returns:
         str: Formatted string with deduplicated sources
@@ -22,49 +53,69 @@ def deduplicate_and_format_sources(search_response, max_tokens_per_source, inclu
     for response in search_response:
         sources_list.extend(response['results'])
     
-    unique_sources = {source['url']: source for source in sources_list}
-    formatted_text = "Content from sources:\n"
-    for i, source in enumerate(unique_sources.values()):
-        formatted_text += f"{'='*80}\n"  # Clear section separator
-        formatted_text += f"Source: {source['title']}\n"
-        formatted_text += f"{'-'*80}\n"  # Subsection separator
-        formatted_text += f"URL: {source['url']}\n===\n"
-        formatted_text += f"Most relevant content from source: {source['content']}\n===\n"
-        if include_raw_content:
-            # Using rough estimate of 4 characters per token
-            char_limit = max_tokens_per_source * 4
-            # Handle None raw_content
-            raw_content = source.get('raw_content', '')
-            if raw_content is None:
-                raw_content = ''
-                print(f"Warning: No raw_content found for source {source['url']}")
-            if len(raw_content) > char_limit:
-                raw_content = raw_content[:char_limit] + "... [truncated]"
-            formatted_text += f"Full source content limited to {max_tokens_per_source} tokens: {raw_content}\n\n"
-        formatted_text += f"{'='*80}\n\n" # End section separator
-                
-    return formatted_text.strip()
-
-
-
-
-
-
-async def select_and_execute_search(search_api, query_list, search_params) -> str:
-    """Select and execute the appropriate search API.
-    
+    return format_sources(
+        sources_list,
+        max_tokens_per_source,
+        include_raw_content,
+        max_total_tokens,
+        tokenizer,
+        relevance_query,
+        max_passages_per_source,
+        near_duplicate_distance
+    )
+
+
+def format_sources(
+        sources_list,
+        max_tokens_per_source,
+        include_raw_content=True,
+        max_total_tokens=None,
+        tokenizer: Optional[Tokenizer] = None,
+        relevance_query: Optional[str] = None,
+        max_passages_per_source: Optional[int] = None,
+        near_duplicate_distance: Optional[int] = 3
+        ):
+    """Deduplicates a flat list of search results and packs them into a context string.
+
+    Takes the same budget and ranking arguments as `deduplicate_and_format_sources`.
+    """
+    unique_sources = list({canonicalize_url(source['url']): source for source in sources_list}.values())
+    if near_duplicate_distance is not None:
+        unique_sources, dedup_stats = remove_near_duplicates(
+            unique_sources,
+            near_duplicate_distance,
+            tokenizer.count if tokenizer else None,
+            max_tokens_per_source
+        )
+        record_dedup_stats(dedup_stats)
+    return pack_sources(
+        unique_sources,
+        max_total_tokens,
+        max_tokens_per_source,
+        include_raw_content,
+        tokenizer,
+        relevance_query,
+        max_passages_per_source
+    )
+
+
+async def run_search_backend(search_api, query_list, search_params) -> list[dict]:
+    """Run the queries against the selected search API without any caching.
+
     Args:
         search_api: Name of the search API to use
         query_list: List of search queries to execute
-        params_to_pass: Parameters to pass to the search API
-        
+        search_params: Parameters to pass to the search API
+
     Returns:
-        Formatted string containing search results
-        
+        List of search responses, one per query
+
     Raises:
         ValueError: If an unsupported search API is specified
     """
     if search_api == "tavily":
+        # tavily is an optional dependency
+        from search.tavily import tavily_search
         search_result = await tavily_search(query_list, **search_params)
     elif search_api == "exa":
         search_result = await exa_search(query_list, **search_params)
@@ -78,5 +129,147 @@ async def select_and_execute_search(search_api, query_list, search_params) -> st
         search_result = await google_search(query_list, **search_params)
     else:
         raise ValueError(f"Unsupported search API: {search_api}")
+
+    return search_result
+
+
+def _is_cacheable(response) -> bool:
+    return isinstance(response, dict) and not response.get("error") and bool(response.get("results"))
+
+
+async def execute_search(search_api, query_list, search_params, cache: Optional[SearchCache] = None) -> list[dict]:
+    """Execute the queries, serving repeated (search_api, query, params) lookups from the cache.
+
+    Only the queries that miss the cache are sent to the search API. A query that is
+    already being searched by a concurrent caller (e.g. a sibling section) awaits that
+    request instead of issuing its own. Failed or empty responses are never cached.
+
+    Args:
+        search_api: Name of the search API to use
+        query_list: List of search queries to execute
+        search_params: Parameters to pass to the search API
+        cache: Optional search cache, see `search.cache.get_search_cache`
+
+    Returns:
+        List of search responses, one per query and in the same order
+    """
+    keys = [make_cache_key(search_api, query, search_params) for query in query_list]
+    responses = await cache.aget_many(keys) if cache is not None else [None] * len(keys)
+    flight = get_search_flight()
+
+    # Missing keys we search ourselves, and keys another caller is already searching
+    leading, waiting = {}, {}
+    for idx, response in enumerate(responses):
+        if response is not None:
+            continue
+        key = keys[idx]
+        if key in leading:
+            leading[key].append(idx)
+        elif key in waiting:
+            waiting[key][1].append(idx)
+        else:
+            future, is_leader = flight.claim(key)
+            if is_leader:
+                leading[key] = [idx]
+            else:
+                waiting[key] = (future, [idx])
+
+    sent = 0
+
+    async def lead(group: Dict[str, List[int]]):
+        """Searches the keys we lead, shares the responses with their waiters and caches them."""
+        nonlocal sent
+        # Only the queries we send ourselves are charged to the search call in progress
+        sent += len(group)
+        add_search_usage(len(group), reused=sum(map(len, group.values())) - len(group))
+        try:
+            fresh = await run_search_backend(search_api, [query_list[idxs[0]] for idxs in group.values()], search_params)
+        except BaseException as e:
+            for key in group:
+                flight.fail(key, e)
+            raise
+        fresh_by_key = dict(zip(group, fresh))
+        for key, idxs in group.items():
+            response = fresh_by_key.get(key)
+            flight.resolve(key, response)
+            for idx in idxs:
+                responses[idx] = response
+        if cache is not None:
+            await cache.aset_many(
+                [(key, response) for key, response in fresh_by_key.items() if _is_cacheable(response)], search_api
+            )
+
+    add_search_usage(0, reused=sum(response is not None for response in responses))
+    if leading:
+        await lead(leading)
+
+    for key, (future, idxs) in waiting.items():
+        while True:
+            try:
+                response = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leading caller was cancelled: search ourselves, or wait for whoever took over
+                future, is_leader = flight.claim(key)
+                if is_leader:
+                    await lead({key: idxs})
+                    break
+                continue
+            add_search_usage(0, reused=len(idxs))
+            for idx in idxs:
+                responses[idx] = response
+            break
+
+    results = []
+    for query, response in zip(query_list, responses):
+        if response is None:
+            continue
+        results.append({**response, "query": query})
+    logger.info(
+        f"{search_api}: {len(query_list) - sent} of {len(query_list)} queries "
+        f"served from cache or concurrent searches"
+    )
+    return results
+
+
+async def select_and_execute_search(
+        search_api, query_list, search_params,
+        cache: Optional[SearchCache] = None,
+        max_tokens_per_source: int = 1000,
+        max_total_tokens: Optional[int] = None,
+        tokenizer: Optional[Tokenizer] = None,
+        relevance_query: Optional[str] = None,
+        max_passages_per_source: Optional[int] = None,
+        near_duplicate_distance: Optional[int] = 3
+        ) -> str:
+    """Select and execute the appropriate search API.
     
-    return deduplicate_and_format_sources(search_result)
\ No newline at end of file
+    Args:
+        search_api: Name of the search API to use
+        query_list: List of search queries to execute
+        search_params: Parameters to pass to the search API
+        cache: Optional search cache, see `search.cache.get_search_cache`
+        max_tokens_per_source: Token cap for the raw content of a single source
+        max_total_tokens: Token budget for the whole formatted string
+        tokenizer: Tokenizer used to measure the budgets
+        relevance_query: Text to rank raw content passages against, None to keep content prefixes
+        max_passages_per_source: Maximum number of passages kept per source when ranking passages
+        near_duplicate_distance: Maximum SimHash distance of near-duplicate sources, None to disable
+        
+    Returns:
+        Formatted string containing search results
+        
+    Raises:
+        ValueError: If an unsupported search API is specified
+    """
+    search_result = await execute_search(search_api, query_list, search_params, cache)
+    return deduplicate_and_format_sources(
+        search_result,
+        max_tokens_per_source,
+        max_total_tokens=max_total_tokens,
+        tokenizer=tokenizer,
+        relevance_query=relevance_query,
+        max_passages_per_source=max_passages_per_source,
+        near_duplicate_distance=near_duplicate_distance
+    )
\ No newline at end of file
@@ -0,0 +1,69 @@
+import asyncio
+import weakref
+from typing import Any, Dict, Optional, Tuple
+from utils import current_run_id
+
+
+class SingleFlight:
+    """Lets concurrent callers asking for the same key share one in-flight request.
+
+    The first caller to `claim` a key becomes its leader and must `resolve` or `fail`
+    it; later callers receive the leader's future and await that instead of issuing
+    their own request. Calls are counted per run, see `get_stats`.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._run_stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, stat: str):
+        stats = self._run_stats.setdefault(current_run_id.get(), {"calls": 0, "leaders": 0, "shared": 0})
+        stats[stat] += 1
+
+    def claim(self, key: str) -> Tuple[asyncio.Future, bool]:
+        """Returns the future for `key` and whether the caller is its leader."""
+        self._count("calls")
+        future = self._calls.get(key)
+        if future is not None:
+            self._count("shared")
+            return future, False
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self._count("leaders")
+        return future, True
+
+    def resolve(self, key: str, value: Any):
+        future = self._calls.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(value)
+
+    def fail(self, key: str, error: BaseException):
+        future = self._calls.pop(key, None)
+        if future is None or future.done():
+            return
+        if isinstance(error, asyncio.CancelledError):
+            future.cancel()
+        else:
+            future.set_exception(error)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+
+    def get_stats(self, run_id: Optional[str] = None) -> Dict[str, int]:
+        """Returns the calls of a run, how many led a request and how many shared another caller's."""
+        return dict(self._run_stats.get(run_id or current_run_id.get(), {"calls": 0, "leaders": 0, "shared": 0}))
+
+    def release_stats(self, run_id: Optional[str] = None):
+        """Forgets the counts of a finished run."""
+        self._run_stats.pop(run_id or current_run_id.get(), None)
+
+
+_flights: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, SingleFlight]" = weakref.WeakKeyDictionary()
+
+
+def get_search_flight() -> SingleFlight:
+    """Returns the single-flight group for searches on the running event loop."""
+    loop = asyncio.get_running_loop()
+    flight = _flights.get(loop)
+    if flight is None:
+        flight = _flights[loop] = SingleFlight()
+    return flight
@@ -0,0 +1,69 @@
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only track the visitor and never change the page
+TRACKING_PARAMS = {
+    "gclid", "dclid", "fbclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+    "_hsenc", "_hsmi", "ref_src", "ref_url", "spm", "cmpid", "ocid",
+}
+TRACKING_PREFIXES = ("utm_", "pk_", "mtm_")
+
+# Redirect wrappers whose target is in a query parameter
+REDIRECT_WRAPPERS = {
+    ("google.com", "/url"): ("q", "url"),
+}
+
+
+def _unwrap_redirect(url: str) -> str:
+    # Relative google result links look like /url?q=<target>&sa=...
+    if url.startswith("/url?"):
+        url = "https://www.google.com" + url
+    for _ in range(3):
+        parts = urlsplit(url)
+        host = parts.hostname or ""
+        host = host[4:] if host.startswith("www.") else host
+        keys = REDIRECT_WRAPPERS.get((host, parts.path))
+        if not keys:
+            break
+        params = dict(parse_qsl(parts.query))
+        target = next((params[key] for key in keys if params.get(key, "").startswith(("http://", "https://"))), None)
+        if target is None:
+            break
+        url = target
+    return url
+
+
+@lru_cache(maxsize=8192)
+def canonicalize_url(url: str) -> str:
+    """Returns the canonical form of a URL so that trivially different links to one page compare equal.
+
+    Unwraps redirect links, treats http and https alike, lower-cases the host, drops
+    "www.", default ports, fragments, tracking parameters, trailing slashes and AMP
+    suffixes, and sorts the remaining query parameters.
+    """
+    if not url:
+        return url
+    url = _unwrap_redirect(url.strip())
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https", ""):
+        return url
+
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+
+    path = parts.path or "/"
+    if path.endswith("/amp") or path.endswith("/amp/"):
+        path = path.rstrip("/")[:-len("/amp")] or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS
+        and not key.lower().startswith(TRACKING_PREFIXES)
+        and not (key.lower() == "amp" and value in ("", "1"))
+    )
+    return urlunsplit(("https", host, path, urlencode(query), ""))
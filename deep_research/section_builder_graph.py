@@ -3,18 +3,19 @@ from state import SectionState, SectionOutputState
 from research_steps import (
     generate_queries,
     search_web,
-    write_section
+    route_section_start
 )
+from reporting import write_section
 
 graph_builder = StateGraph(SectionState, output=SectionOutputState)
 
-graph_builder.add_node("genrrate_queries", generate_queries)
+graph_builder.add_node("generate_queries", generate_queries)
 graph_builder.add_node("search_web", search_web)
 graph_builder.add_node("write_section", write_section)
 
 #edges
-graph_builder.add_edge(START, "genrrate_queries")
-graph_builder.add_edge("genrrate_queries", "search_web")
+graph_builder.add_conditional_edges(START, route_section_start, ["generate_queries", "write_section"])
+graph_builder.add_edge("generate_queries", "search_web")
 graph_builder.add_edge("search_web", "write_section")
 
 graph = graph_builder.compile()
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import Annotated, List, TypedDict, Literal
+from typing import Annotated, List, Optional, TypedDict, Literal
 from pydantic import BaseModel, Field
 import operator
 
@@ -8,6 +8,11 @@ class SearchQuery(BaseModel):
 class Queries(BaseModel):
     queries: List[SearchQuery] = Field(description="List of search queries for the report")
 
+    @property
+    def confidence(self) -> float:
+        """An empty query list counts as an unusable answer in model cascades."""
+        return 1.0 if self.queries else 0.0
+
 class Section(BaseModel):
     name: str = Field(description="Name for this section of the report")
     description: str = Field(description="Description of the main topics and concepts covered in this section")
@@ -17,12 +22,22 @@ class Section(BaseModel):
 class Sections(BaseModel):
     sections: List[Section] = Field(description="List of sections for the report")
 
+def merge_source_refs(existing: List[str], new: List[str]) -> List[str]:
+    """Reducer adding newly retrieved corpus ids to a section's sources, keeping the first occurrence."""
+    existing = existing or []
+    seen = set(existing)
+    return existing + [ref for ref in (new or []) if not (ref in seen or seen.add(ref))]
+
 class SectionState(TypedDict):
     topic: str
     section: Section
     search_iterations: int = Field(default=0, description="The number of search iterations performed for this section")
     search_queries: List[SearchQuery] = Field(default=[], description="The list of search queries for this section")
-    source_str: str = Field(description="The source string or the formatter source content from the web search for this section")
+    source_refs: Annotated[List[str], merge_source_refs] = Field(default=[], description="Ids of the run corpus documents retrieved for this section, accumulated across search iterations")
+    seed_coverage: float = Field(default=0.0, description="How well the seed sources from planning cover the section, between 0 and 1")
+    queries_issued: int = Field(default=0, description="The number of search queries issued for this section")
+    new_sources: int = Field(default=0, description="The number of sources the last search iteration added")
+    novelty: float = Field(default=1.0, description="The share of passages retrieved by the last search iteration that the section did not have yet")
     report_sections_from_research: str = Field(description="Any completed sections from research to write final sections")
     completed_sections: List[Section]
 
@@ -37,18 +52,38 @@ class Feedback(BaseModel):
     follow_up_queries: List[SearchQuery] = Field(
         description="List of follow-up search queries."
     )
+    confidence: Optional[float] = Field(
+        default=None,
+        description="How confident you are in the grade, between 0 and 1."
+    )
+
+class SectionGrade(BaseModel):
+    section: str = Field(description="The name of the graded section, exactly as given")
+    feedback: Feedback = Field(description="The grade and follow-up queries for the section")
+
+class SectionGrades(BaseModel):
+    grades: List[SectionGrade] = Field(description="One grade per section, in the order the sections were given")
+
+    @property
+    def confidence(self) -> Optional[float]:
+        """The lowest confidence of the grades, None if no grade reports one."""
+        confidences = [grade.feedback.confidence for grade in self.grades if grade.feedback.confidence is not None]
+        return min(confidences) if confidences else None
 
 class ReportStateInput(TypedDict):
     topic: str
 
 class ReportStateOutput(TypedDict):
     final_report: str
+    run_summary: dict
 
 class ReportState(TypedDict):
     topic: str
     feedback_on_report_plan: str
     sections: List[Section]
+    planning_source_refs: List[str] = Field(default=[], description="Ids of the run corpus documents retrieved while planning")
     completed_sections: Annotated[list, operator.add] = Field(default=[], description="List of completed sections")
     report_sections_from_research: str
     final_report: str
+    run_summary: dict = Field(default={}, description="Time, tokens, retries and estimated cost of the run's model and search calls, see accounting.summarize_run")
 
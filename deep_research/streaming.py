@@ -0,0 +1,128 @@
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from langchain_core.runnables import RunnableConfig
+from langgraph.config import get_stream_writer
+from state import Section
+from utils import current_run_id
+
+
+def emit(event: dict):
+    """Sends a custom stream event to callers streaming with stream_mode="custom".
+
+    Events are dicts with a "type" key: "section_progress", "section_token" or "report".
+    Events emitted by the section builder subgraph only reach callers that also pass
+    `subgraphs=True`, see `stream_report_events`. Outside a graph run the event is dropped.
+    """
+    try:
+        writer = get_stream_writer()
+    except RuntimeError:
+        return
+    writer(event)
+
+
+def emit_progress(section: Section, stage: str, iteration: int, **details):
+    """Reports a section reaching a stage: searching, writing, grading, follow_up or complete."""
+    emit({"type": "section_progress", "section": section.name, "stage": stage, "iteration": iteration, **details})
+
+
+def token_emitter(section: Section, iteration: int) -> Callable[[str], None]:
+    """Returns a callback streaming the tokens of one draft of a section.
+
+    A section redrafted after a follow-up search streams again with a higher iteration;
+    the newer draft replaces the older one.
+    """
+    def on_token(token: str):
+        emit({"type": "section_token", "section": section.name, "iteration": iteration, "token": token})
+    return on_token
+
+
+async def stream_report_events(graph, input: Any, config: Optional[RunnableConfig] = None) -> AsyncIterator[dict]:
+    """Runs the report graph and yields its custom stream events, those of the subgraphs included.
+
+    Most events are emitted inside the section builder subgraph, which the parent graph
+    only passes on when streamed with `subgraphs=True`; with stream_mode="custom" alone
+    the caller only sees the events of the final section writers. Example:
+
+        async for event in stream_report_events(graph, Command(resume=True), config):
+            if event["type"] == "report":
+                print(event["content"])
+
+    Args:
+        graph: The compiled report graph, see `graph.graph`
+        input: The graph input, or a `Command` resuming an interrupted run
+        config: The run config with its thread_id and configurable settings
+    """
+    async for _namespace, event in graph.astream(input, config, stream_mode="custom", subgraphs=True):
+        yield event
+
+
+class ReportAssembler:
+    """Builds the report incrementally while sections complete in any order.
+
+    Each completed section is filled in at its position in the plan, so the report
+    so far always reads in plan order with the pending sections left out.
+    """
+
+    def __init__(self, section_names: List[str]):
+        self.section_names = list(section_names)
+        self._contents: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def complete(self, section: Section) -> int:
+        """Records a completed section and returns its position in the plan, -1 if it is not in the plan."""
+        with self._lock:
+            self._contents[section.name] = section.content
+        return self.section_names.index(section.name) if section.name in self.section_names else -1
+
+    @property
+    def report(self) -> str:
+        """The completed sections joined in plan order."""
+        with self._lock:
+            return "\n\n".join(self._contents[name] for name in self.section_names if name in self._contents)
+
+    @property
+    def completed(self) -> int:
+        return sum(name in self._contents for name in self.section_names)
+
+    @property
+    def done(self) -> bool:
+        return self.completed == len(self.section_names)
+
+
+_assemblers: Dict[str, ReportAssembler] = {}
+_assemblers_lock = threading.Lock()
+
+
+def start_report_assembler(section_names: List[str], run_id: Optional[str] = None) -> ReportAssembler:
+    """Creates the report assembler of a run for the approved plan, replacing any earlier one."""
+    with _assemblers_lock:
+        assembler = _assemblers[run_id or current_run_id.get()] = ReportAssembler(section_names)
+        return assembler
+
+
+def get_report_assembler(run_id: Optional[str] = None) -> Optional[ReportAssembler]:
+    with _assemblers_lock:
+        return _assemblers.get(run_id or current_run_id.get())
+
+
+def release_report_assembler(run_id: Optional[str] = None):
+    """Forgets the report assembler of a finished run."""
+    with _assemblers_lock:
+        _assemblers.pop(run_id or current_run_id.get(), None)
+
+
+def section_completed(section: Section, iteration: int = 0):
+    """Reports a completed section and streams the report with the section filled in."""
+    emit_progress(section, "complete", iteration)
+    assembler = get_report_assembler()
+    if assembler is None:
+        return
+    position = assembler.complete(section)
+    emit({
+        "type": "report",
+        "section": section.name,
+        "position": position,
+        "completed": assembler.completed,
+        "total": len(assembler.section_names),
+        "content": assembler.report
+    })
@@ -1,4 +1,15 @@
 
+import contextvars
+
+# Identifies the report run whose per-run state (corpus, search budget, ...) the current task uses
+current_run_id: contextvars.ContextVar[str] = contextvars.ContextVar("current_run_id", default="default")
+
+# Parameters each search API accepts from search_api_config
+SEARCH_API_PARAMS = {
+    "exa": ["include_domains", "exclude_domains", "subpages", "max_concurrency", "requests_per_second", "max_retries"],
+    "google": ["max_results", "include_raw_content", "use_thread_pool", "max_content_bytes", "max_content_chars"],
+    "tavily": [],
+}
 
 def get_config_value(value):
     return value if isinstance(value, str) else value.value
@@ -14,4 +25,20 @@ def get_search_params(search_api, search_api_config):
     Returns:
         Dict[str, Any]: A dictionary of parameters to pass to the search function.
     """
-    
\ No newline at end of file
+    accepted_params = SEARCH_API_PARAMS.get(search_api, [])
+    if not search_api_config:
+        return {}
+    return {k: v for k, v in search_api_config.items() if k in accepted_params}
+
+
+def get_run_id(config) -> str:
+    """Returns the id that scopes per-run state: the thread id of the run, if any."""
+    configurable = (config or {}).get("configurable", {})
+    return str(configurable.get("thread_id") or configurable.get("report_id") or "default")
+
+
+def bind_run(config) -> str:
+    """Makes the run of `config` the current run for everything awaited by the calling node."""
+    run_id = get_run_id(config)
+    current_run_id.set(run_id)
+    return run_id